@@ -0,0 +1,84 @@
+"""
+统计图表刷新基准测试：比较每次清空子图重新绘制、保留折线只更新数据、实时追加时只blit新增线段三种方式的单帧耗时
+用法：python benchmarks/bench_chart_frame.py [点数 ...]，默认测试1万和50万个点，使用Agg后端，无需显示器
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import WeatherSysGUI
+
+FRAMES = 20
+
+class ChartPage():
+    """只包含统计图表页的界面，借用WeatherSysGUI中绘图相关的方法"""
+    refresh_chart = WeatherSysGUI.refresh_chart
+    set_chart_data = WeatherSysGUI.set_chart_data
+    sort_chart_points = staticmethod(WeatherSysGUI.sort_chart_points)
+    update_chart_view = WeatherSysGUI.update_chart_view
+    append_chart_points = WeatherSysGUI.append_chart_points
+    chart_width = WeatherSysGUI.chart_width
+    resample_chart = WeatherSysGUI.resample_chart
+    ready_pages = {"统计图表"}
+
+    def __init__(self) -> None:
+        self.fig = Figure(figsize=(10, 8), dpi=100)
+        self.ax = self.fig.add_subplot(111)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.chart_lines = {}
+        self.chart_data = {}
+        self.chart_labels = (None, None)
+        self.ax.callbacks.connect("xlim_changed", self.resample_chart)
+
+def clear_and_plot(ax, canvas, xs, ys):
+    """改动前的刷新方式：清空子图，绘制全部点，重设刻度并整体重绘"""
+    ax.clear()
+    ax.plot(xs, ys)
+    ax.set_xlabel("time")
+    ax.set_ylabel("measure_value")
+    ax.set_yticks(np.linspace(max(ys), min(ys), 10))
+    canvas.draw()
+
+def bench(points):
+    rng = np.random.default_rng(0)
+    xs = (pd.Timestamp("2023-01-01") + pd.to_timedelta(np.arange(points), unit="min")).to_numpy()
+    ys = np.sin(np.arange(points) / 5000) + rng.standard_normal(points) * 0.1
+    new_xs = xs[-1] + pd.to_timedelta(np.arange(1, FRAMES + 1), unit="min").to_numpy()
+    new_ys = rng.uniform(ys.min() / 2, ys.max() / 2, FRAMES)
+    # 改动前
+    fig = Figure(figsize=(10, 8), dpi=100)
+    ax = fig.add_subplot(111)
+    canvas = FigureCanvasAgg(fig)
+    begin = time.perf_counter()
+    for i in range(FRAMES):
+        clear_and_plot(ax, canvas, np.concatenate([xs, new_xs[:i + 1]]), list(np.concatenate([ys, new_ys[:i + 1]])))
+    old_time = (time.perf_counter() - begin) / FRAMES
+    # 保留折线，只更新数据并重绘
+    page = ChartPage()
+    page.refresh_chart({0: (xs, ys)}, "time", "measure_value")
+    page.canvas.draw()
+    begin = time.perf_counter()
+    for i in range(FRAMES):
+        # Agg后端的draw_idle会立即重绘
+        page.refresh_chart({0: (np.concatenate([xs, new_xs[:i + 1]]), np.concatenate([ys, new_ys[:i + 1]]))}, "time", "measure_value")
+    refresh_time = (time.perf_counter() - begin) / FRAMES
+    # 实时追加，x轴范围预留出新点的位置，新增线段直接blit
+    page = ChartPage()
+    page.refresh_chart({0: (xs, ys)}, "time", "measure_value")
+    page.ax.set_xlim(page.chart_data[0][2][0], page.chart_data[0][2][-1] + FRAMES / 1440)
+    page.canvas.draw()
+    begin = time.perf_counter()
+    for i in range(FRAMES):
+        page.append_chart_points(0, new_xs[i:i + 1], new_ys[i:i + 1])
+    append_time = (time.perf_counter() - begin) / FRAMES
+    print(f"{points:>8} 点  清空重绘: {old_time * 1000:8.1f} ms/帧  更新数据: {refresh_time * 1000:7.1f} ms/帧  追加blit: {append_time * 1000:6.2f} ms/帧")
+
+if __name__ == "__main__":
+    for points in [int(arg) for arg in sys.argv[1:]] or [10_000, 500_000]:
+        bench(points)
@@ -0,0 +1,58 @@
+"""
+测量记录表时间范围查询基准测试：比较逐列布尔掩码筛选与按(传感器ID, 时间)排序后二分查找的耗时
+用法：python benchmarks/bench_record_range.py [行数 ...]，默认测试100万和1000万行
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model import Model, NpyStorage
+
+SENSORS = 100
+QUERIES = 20
+
+def make_storage(path, rows):
+    """生成一个含rows条测量记录的NpyStorage"""
+    storage = NpyStorage(path)
+    rng = np.random.default_rng(0)
+    storage.save("station", pd.DataFrame({"id": [0], "测量站名称": ["A"], "代表地区": ["南京"], "测量站状态": ["上线"]}))
+    storage.save("place", pd.DataFrame({"id": [0], "地点编号": ["P"], "经度": [118.0], "纬度": [32.0], "海拔": [10.0], "地点状态": ["上线"], "测量站ID": [0]}))
+    storage.save("sensor", pd.DataFrame({"id": range(SENSORS), "传感器类型": "温度传感器", "测量值单位": "℃", "传感器编号": "S", "上线时间": "2023-01-01", "下线时间": "2027-01-01", "传感器状态": "上线", "地点ID": 0}))
+    times = pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit="s")
+    storage.save("record", pd.DataFrame({"id": np.arange(rows), "时间": times, "测量值": rng.random(rows), "传感器ID": rng.integers(0, SENSORS, rows)}))
+    return storage
+
+def bench(rows):
+    with tempfile.TemporaryDirectory() as path:
+        model = Model(storage=make_storage(path, rows))
+        df = model.record_df
+        rng = np.random.default_rng(1)
+        queries = []
+        for _ in range(QUERIES):
+            start = pd.Timestamp("2023-01-01") + pd.Timedelta(days=int(rng.integers(0, 358)))
+            queries.append((int(rng.integers(0, SENSORS)), str(start), str(start + pd.Timedelta(days=7))))
+        # 布尔掩码筛选
+        begin = time.perf_counter()
+        for sensor_id, start, end in queries:
+            mask_result = df[(df["传感器ID"] == sensor_id) & (df["时间"] >= start) & (df["时间"] <= end)]
+        mask_time = (time.perf_counter() - begin) / QUERIES
+        # 第一次查询会建立排序索引，单独计时
+        begin = time.perf_counter()
+        model.query("record", return_df=True, 时间=queries[0][1:], 传感器ID=queries[0][0])
+        build_time = time.perf_counter() - begin
+        begin = time.perf_counter()
+        for sensor_id, start, end in queries:
+            index_result = model.query("record", return_df=True, 时间=(start, end), 传感器ID=sensor_id)
+        index_time = (time.perf_counter() - begin) / QUERIES
+        assert index_result.equals(mask_result)
+        model.close()
+        print(f"{rows:>10} 行  掩码: {mask_time * 1000:8.2f} ms/次  二分查找: {index_time * 1000:8.3f} ms/次  建立索引: {build_time:6.2f} s")
+
+if __name__ == "__main__":
+    for rows in [int(arg) for arg in sys.argv[1:]] or [1_000_000, 10_000_000]:
+        bench(rows)
@@ -0,0 +1,64 @@
+"""
+启动时间基准测试：在新进程中分别测量导入model、导入main的耗时，以及从进程启动到窗口第一次显示、
+到第一个分页的表格显示出查询结果的耗时，并检查窗口显示时是否已经导入了matplotlib
+用法：python benchmarks/bench_startup.py [数据目录]，默认使用data目录；测量窗口需要图形界面（DISPLAY）
+"""
+import json
+import os
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import_code = """
+import json, sys, time
+begin = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - begin, "matplotlib": "matplotlib" in sys.modules}}))
+"""
+
+window_code = """
+import json, sys, time
+begin = time.perf_counter()
+import main
+result = {}
+app = main.WeatherSysGUI()
+def mapped(event):
+    if "window" not in result:
+        result["window"] = time.perf_counter() - begin
+        result["matplotlib"] = "matplotlib" in sys.modules
+def poll():
+    # 第一个分页的表格有了数据即认为启动完成
+    tree = getattr(app, "station_tree", None)
+    if tree is not None and len(app.tree_views[tree]["df"]):
+        result["table"] = time.perf_counter() - begin
+        app.destroy()
+        return
+    app.after(10, poll)
+app.bind("<Map>", mapped)
+app.after(10, poll)
+app.mainloop()
+print(json.dumps(result))
+"""
+
+def run(code, data_dir):
+    """在数据目录中启动新进程执行code，返回其输出的JSON"""
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.run([sys.executable, "-c", code], cwd=data_dir, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    # model.py与main.py按相对于当前目录的data目录读取数据
+    data_dir = os.path.dirname(os.path.abspath(sys.argv[1])) if len(sys.argv) > 1 else root
+    for module in ("model", "main"):
+        result = run(import_code.format(module=module), data_dir)
+        print(f"import {module}: {result['seconds'] * 1000:.0f} ms，已导入matplotlib：{result['matplotlib']}")
+    if not os.environ.get("DISPLAY") and sys.platform.startswith("linux"):
+        print("没有图形界面，跳过窗口显示时间的测量")
+        return
+    result = run(window_code, data_dir)
+    print(f"窗口第一次显示：{result['window'] * 1000:.0f} ms，已导入matplotlib：{result['matplotlib']}")
+    print(f"第一个分页显示查询结果：{result['table'] * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
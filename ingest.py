@@ -0,0 +1,155 @@
+"""
+无界面的测量记录导入工具，只依赖model.py，不需要tkinter、matplotlib和剪贴板
+命令行：python ingest.py 记录.csv [记录.jsonl ...] [--batch-size 10000]，文件为-时从标准输入读取
+HTTP服务：python ingest.py --serve [--host 127.0.0.1] [--port 8765]
+    POST /records  提交一批记录，Content-Type为text/csv时按CSV解析，否则按JSON Lines解析，返回接收与拒绝的条数
+    GET /metrics   返回累计导入的批数、条数与每秒导入的条数
+每条记录包含时间、测量值、传感器ID三个字段，时间或测量值无法解析、传感器不存在的记录会被拒绝
+记录按批调用Model.insert_many追加写入；数据量大时使用--storage partitioned --lazy，导入时无需读取已有的测量记录
+导入工具与服务独占数据目录的写入：运行期间界面以只读方式打开，只能查询，并定期重新读取以看到新导入的记录；
+界面以读写方式打开时导入工具无法启动，需要先关闭界面
+"""
+import argparse
+import io
+import json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pandas as pd
+
+from model import Model, CsvStorage, NpyStorage, PartitionedStorage, data_dir
+
+record_fields = ["时间", "测量值", "传感器ID"]
+storages = {"csv": CsvStorage, "npy": NpyStorage, "partitioned": PartitionedStorage}
+
+class Ingestor():
+    """校验并写入测量记录，统计导入速率"""
+
+    def __init__(self, model : Model) -> None:
+        self.model = model
+        self.stats = {"batches": 0, "accepted": 0, "rejected": 0, "seconds": 0.0}
+
+    def validate(self, rows : pd.DataFrame) -> tuple:
+        """向量化校验一批记录，返回(可以写入的记录, 被拒绝记录的序号与原因列表)，时间按ISO 8601格式解析"""
+        missing = [field for field in record_fields if field not in rows.columns]
+        if missing:
+            raise ValueError(f"缺少字段：{','.join(missing)}")
+        times = pd.to_datetime(rows["时间"], format="ISO8601", errors="coerce")
+        values = pd.to_numeric(rows["测量值"], errors="coerce")
+        sensors = pd.to_numeric(rows["传感器ID"], errors="coerce")
+        reasons = pd.Series("", index=rows.index)
+        reasons[~sensors.isin(self.model.get_df("sensor")["id"])] = "传感器不存在"
+        reasons[values.isna()] = "测量值无法解析"
+        reasons[times.isna()] = "时间无法解析"
+        valid = reasons == ""
+        accepted = pd.DataFrame({"时间": times[valid], "测量值": values[valid], "传感器ID": sensors[valid].astype("int64")})
+        rejected = [{"row": int(row), "reason": reason} for row, reason in reasons[~valid].items()]
+        return accepted, rejected
+
+    def ingest(self, rows : pd.DataFrame) -> dict:
+        """校验并写入一批记录，返回接收条数、拒绝条数及前10条被拒绝的原因"""
+        begin = time.perf_counter()
+        accepted, rejected = self.validate(rows)
+        ids = self.model.insert_many("record", accepted) if len(accepted) else []
+        self.stats["batches"] += 1
+        self.stats["accepted"] += len(ids)
+        self.stats["rejected"] += len(rejected)
+        self.stats["seconds"] += time.perf_counter() - begin
+        return {"accepted": len(ids), "rejected": len(rejected), "errors": rejected[:10]}
+
+    def metrics(self) -> dict:
+        """累计导入统计，rows_per_second为校验加写入的平均速率"""
+        seconds = self.stats["seconds"]
+        return dict(self.stats, rows_per_second=self.stats["accepted"] / seconds if seconds else 0.0)
+
+def read_batches(path : str, batch_size : int, fmt : str = None):
+    """按batch_size行分批读取CSV或JSON Lines文件，fmt为None时按扩展名判断，path为-时从标准输入读取"""
+    source = sys.stdin if path == "-" else path
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+    if fmt == "jsonl":
+        return pd.read_json(source, lines=True, chunksize=batch_size, dtype=False)
+    return pd.read_csv(source, chunksize=batch_size)
+
+def parse_body(body : bytes, content_type : str) -> pd.DataFrame:
+    """解析HTTP请求体中的一批记录"""
+    if "csv" in content_type:
+        return pd.read_csv(io.BytesIO(body))
+    return pd.read_json(io.BytesIO(body), lines=True, dtype=False)
+
+class IngestHandler(BaseHTTPRequestHandler):
+    """导入服务的请求处理，server.ingestor为共用的Ingestor"""
+
+    def do_POST(self):
+        if self.path != "/records":
+            return self.send_json(404, {"error": "not found"})
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            rows = parse_body(body, self.headers.get("Content-Type", ""))
+            result = self.server.ingestor.ingest(rows)
+        except (ValueError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            return self.send_json(400, {"error": str(e)})
+        self.send_json(200, result)
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            return self.send_json(404, {"error": "not found"})
+        self.send_json(200, self.server.ingestor.metrics())
+
+    def send_json(self, status : int, content : dict):
+        """返回JSON响应"""
+        body = json.dumps(content, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def make_model(args) -> Model:
+    """按命令行参数创建数据模型"""
+    storage = storages[args.storage](args.data_dir)
+    return Model(storage=storage, lazy_record=args.lazy)
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description="导入测量记录")
+    parser.add_argument("files", nargs="*", help="CSV或JSON Lines文件，-表示标准输入")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="文件格式，默认按扩展名判断")
+    parser.add_argument("--batch-size", type=int, default=10000, help="每批写入的记录数")
+    parser.add_argument("--storage", choices=list(storages), default="csv", help="存储后端，需与界面使用的一致")
+    parser.add_argument("--data-dir", default=data_dir, help="数据目录")
+    parser.add_argument("--lazy", action="store_true", help="不读取已有的测量记录（需要--storage partitioned）")
+    parser.add_argument("--serve", action="store_true", help="启动HTTP导入服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+    try:
+        model = make_model(args)
+    except Model.DataDirLockedError as e:
+        # 界面或另一个导入进程正在使用该数据目录，同时写入会互相覆盖
+        print(e, file=sys.stderr)
+        return 1
+    ingestor = Ingestor(model)
+    try:
+        for path in args.files:
+            for rows in read_batches(path, args.batch_size, args.format):
+                result = ingestor.ingest(rows)
+                for error in result["errors"]:
+                    print(f"{path} 第{error['row'] + 1}条记录被拒绝：{error['reason']}", file=sys.stderr)
+        if args.files:
+            metrics = ingestor.metrics()
+            print(f"导入{metrics['accepted']}条，拒绝{metrics['rejected']}条，共{metrics['batches']}批，{metrics['rows_per_second']:.0f}条/秒")
+        if args.serve:
+            server = HTTPServer((args.host, args.port), IngestHandler)
+            server.ingestor = ingestor
+            print(f"导入服务已启动：http://{args.host}:{args.port}/records")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.server_close()
+    finally:
+        # 退出前做检查点，把预写日志中的改动写入表文件，并释放数据目录锁
+        model.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
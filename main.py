@@ -1,17 +1,15 @@
 import os
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import tkinter as tk
 from tkinter import ttk
 import tkinter.font as tkFont
 import tkinter.messagebox as tkMessageBox
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
-# Implement the default Matplotlib key bindings.
-from matplotlib.backend_bases import key_press_handler
-from matplotlib.figure import Figure
-from matplotlib.font_manager import FontProperties
 import numpy as np
-import clipboard
+# matplotlib与clipboard在第一次使用时才导入，加快启动
+from model import Model, data_dir
 
 def str_to_num(s):
     try:
@@ -21,250 +19,26 @@ def str_to_num(s):
             return float(s)
         except ValueError:
             return s
-# 获取当前工作目录
-current_path = os.getcwd()
-# 获取data目录下的四个数据文件路径
-station_path = os.path.join(current_path, "data", "测量站表.csv")
-place_path = os.path.join(current_path, "data", "地点表.csv")
-sensor_path = os.path.join(current_path, "data", "传感器表.csv")
-record_path = os.path.join(current_path, "data", "测量记录表.csv")
-
-class Model():
+
+def m4_downsample(x : np.ndarray, y : np.ndarray, width : int) -> np.ndarray:
     """
-    这个类用来存储、管理数据，为前端提供数据接口
+    M4降采样：把按x排好序的点按x等分为width段，每段只保留第一个、最后一个、最小值、最大值对应的点，返回保留点的下标
+    折线画到width像素宽时与画出全部点的形状相同，保留的点数不超过4*width
     """
+    if len(x) <= 4 * width:
+        return np.arange(len(x))
+    span = x[-1] - x[0]
+    buckets = ((x - x[0]) * (width / span if span else 0)).astype("int64").clip(0, width - 1)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(x)] - 1
+    counts = ends - starts + 1
+    keep = [starts, ends]
+    for extreme in (np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)):
+        # 每段中第一个取到最小值（最大值）的点
+        hits = np.flatnonzero(y == np.repeat(extreme, counts))
+        keep.append(hits[np.r_[True, buckets[hits][1:] != buckets[hits][:-1]]])
+    return np.unique(np.concatenate(keep))
 
-    def __init__(self) -> None:
-        """初始化数据模型"""
-        self.station_df = None
-        self.place_df = None
-        self.sensor_df = None
-        self.record_df = None
-        self.eng2chs = {"station": "测量站", "place": "地点", "sensor": "传感器", "record": "测量记录"}
-        self.order = ["station", "place", "sensor", "record"] # 层级表
-        self.name_list = ["测量站", "地点", "传感器", "测量记录"] # 名称表
-        self.load_df()
-
-    def load_df(self):
-        """重载数据"""
-        data_dir = os.path.join(current_path, "data")
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-        data_files = [
-            {"path": station_path, "header": "id,测量站名称,代表地区,测量站状态\n", "table_name": "station"},
-            {"path": place_path, "header": "id,地点编号,经度,纬度,海拔,地点状态,测量站ID\n", "table_name": "place"},
-            {"path": sensor_path, "header": "id,传感器类型,测量值单位,传感器编号,上线时间,下线时间,传感器状态,地点ID\n", "table_name": "sensor"},
-            {"path": record_path, "header": "id,时间,测量值,传感器ID\n", "table_name": "record"}
-        ]
-        for file in data_files:
-            path = file["path"]
-            header = file["header"]
-            table_name = file["table_name"] + "_df"
-            # 检查数据文件是否存在，如果不存在则创建
-            if not os.path.exists(path):
-                with open(path, 'w', encoding="utf-8") as f:
-                    f.write(header)
-            # 尝试读取数据文件，如果文件为空则写入表头，如果文件格式错误则删除文件并重新写入表头
-            try:
-                setattr(self, table_name, pd.read_csv(path))
-            except pd.errors.EmptyDataError:
-                with open(path, 'w', encoding="utf-8") as f:
-                    f.write(header)
-                setattr(self, table_name, pd.read_csv(path))
-            except pd.errors.ParserError:
-                os.remove(path)
-                with open(path, 'w', encoding="utf-8") as f:
-                    f.write(header)
-                setattr(self, table_name, pd.read_csv(path))
-    
-    def save_df(self):
-        """保存数据"""
-        self.station_df.to_csv(station_path, index=False)
-        self.place_df.to_csv(place_path, index=False)
-        self.sensor_df.to_csv(sensor_path, index=False)
-        self.record_df.to_csv(record_path, index=False)
-
-    # 定义一个类内异常类：删除违反参照完整性
-    class DelReferentialIntegrityError(Exception):
-        """违反参照完整性"""
-        def __init__(self, table_name : str, id : int, ref_table_name : str, ids : list) -> None:
-            self.table_name = table_name
-            self.id = id
-            self.ref_table_name = ref_table_name
-            self.ids = ids
-        def __str__(self) -> str:
-            return f"删除违反参照完整性：{self.table_name}表中的id为{self.id}的数据被{self.ref_table_name}表中id为{self.ids}的数据作为外键引用"
-    # 定义一个类内异常类：外键不存在
-    class ForeignKeyNotExistError(Exception):
-        """外键不存在"""
-        def __init__(self, table_name : str, ref_table_name : str, foreign_id : int) -> None:
-            self.table_name = table_name
-            self.ref_table_name = ref_table_name
-            self.foreign_id = foreign_id
-        def __str__(self) -> str:
-            return f"外键不存在：{self.table_name}表中引用的外键\"{self.ref_table_name}ID={self.foreign_id}\"不存在"
-    # 定义一个类内异常类：索引不存在
-    class IndexNotExistError(Exception):
-        """索引不存在"""
-        def __init__(self, table_name : str, index : str) -> None:
-            self.table_name = table_name
-            self.index = index
-        def __str__(self) -> str:
-            return f"索引不存在：{self.table_name}表中的索引\"{self.index}\"不存在"
-    class FieldNotExistError(Exception):
-        """字段不存在"""
-        def __init__(self, table_name : str, field : str) -> None:
-            self.table_name = table_name
-            self.field = field
-        def __str__(self) -> str:
-            return f"字段不存在：{self.table_name}表中的字段\"{self.field}\"不存在"
-
-    # 接下来写增删查改的方法
-
-    def query(self, table_name, return_df = False, orient = "split", **kwargs) -> list:
-        """查询数据，字段允许接受单个值、二元元组代表范围、列表"""
-        # 判断table_name是否为str，如果是则转换为对应的df视图
-        if isinstance(table_name, str):
-            df = getattr(self, table_name + "_df")
-        else:
-            df = table_name
-        for key, value in kwargs.items():
-            if isinstance(value, tuple):
-                left, right = value
-                # 判断有无空字符串
-                if left == "" and right == "":
-                    continue
-                elif left == "":
-                    df = df[df[key] <= right]
-                elif right == "":
-                    df = df[df[key] >= left]
-                else:
-                    df = df[(df[key] >= left) & (df[key] <= right)]
-            elif isinstance(value, list):
-                df = df[df[key].isin(value)]
-            else:
-                df = df[df[key] == value]
-        return df if return_df else df.to_dict(orient=orient)
-    
-    def insert(self, table_name: str, **kwargs):
-        """插入数据"""
-        # 检查外键是否存在
-        self.raise_foreign_key(table_name, kwargs)
-        # 拿到df视图
-        df = getattr(self, table_name + "_df")
-        new_id = df["id"].max()
-        if new_id != new_id :
-            new_id = 0
-        else:
-            new_id += 1
-        kwargs["id"] = new_id
-        df = pd.concat([df, pd.DataFrame([kwargs])], ignore_index=True)
-        setattr(self, table_name + "_df", df)
-        self.save_df()
-    
-    def update(self, table_name : str, id : int, **kwargs):
-        """更新数据"""
-        df = getattr(self, table_name + "_df")
-        # 检查id是否存在，如果不存在，引发索引不存在异常
-        if id not in df["id"].values:
-            raise self.IndexNotExistError(self.eng2chs[table_name], id)
-        # 如果修改了外键，检查外键是否存在
-        index = self.order.index(table_name)
-        zh_ref_table_name = self.name_list[index - 1]
-        if zh_ref_table_name + "ID" in kwargs.keys():
-            self.raise_foreign_key(table_name, kwargs)
-        df.loc[df["id"] == id, kwargs.keys()] = list(kwargs.values())
-        setattr(self, table_name + "_df", df)
-        self.save_df()
-
-    def delete(self, table_name : str, ids : list):
-        """删除数据"""
-        df = getattr(self, table_name + "_df")
-        if not isinstance(ids, list):
-            ids = [ids]
-        for id in ids:
-            # 检查id是否存在，如果不存在，跳过本轮循环
-            if id not in df["id"].values:
-                continue
-            result = self.get_foreign_key(table_name, id)
-            if result[1]:
-                raise self.DelReferentialIntegrityError(self.eng2chs[table_name], id, result[0], result[1])
-        df = df[~df["id"].isin(ids)]
-        setattr(self, table_name + "_df", df)
-        self.save_df()
-
-    # 检查给定表主键是否被其他表作为外键引用，若有则返回其他表中引用项的id
-    def get_foreign_key(self, table_name : str, id : int) -> list:
-        """检查给定表主键是否被其他表作为外键引用"""
-        # 如果是record表，直接返回空列表
-        if table_name == "record":
-            return (None,[])
-        # 获取给定表的层次顺序
-        table_order = self.order.index(table_name)
-        # 获取下一层次表的df对象
-        df = getattr(self, self.order[table_order + 1] + "_df")
-        # 对下一层次表进行筛选，找到外键为给定id的项
-        df = df[df[self.name_list[table_order] + "ID"] == id]
-        # 获取下一层次表的id列表
-        id_list = df["id"].tolist()
-        # 返回下一层次表的id列表
-        return (self.name_list[table_order+1],id_list)
-    
-    # 检查外键是否存在
-    def check_foreign_key(self, table_name : str, foreign_id : int) -> bool:
-        """检查外键是否存在"""
-        # 如果是station表，直接返回True
-        if table_name == "station":
-            return True
-        # 获取给定表的层次顺序
-        table_order = self.order.index(table_name)
-        # 获取上一层次表的df对象
-        df = getattr(self, self.order[table_order - 1] + "_df")
-        # 对上一层次表进行筛选，找到id为给定外键的项
-        df = df[df["id"] == foreign_id]
-        # 获取上一层次表的id列表
-        id_list = df["id"].tolist()
-        # 如果id列表为空，则返回False，否则返回True
-        return len(id_list) != 0
-
-    # 引发外键不存在的异常
-    def raise_foreign_key(self,table_name : str, kwargs : dict):
-        # 检查外键是否存在
-        index = self.order.index(table_name)
-        zh_ref_table_name = self.name_list[index - 1]
-        zh_table_name = self.name_list[index]
-        foreign_id = kwargs.get(zh_ref_table_name + "ID", None)
-        if not self.check_foreign_key(table_name, foreign_id):
-            raise self.ForeignKeyNotExistError(zh_table_name, zh_ref_table_name, foreign_id)
-
-    # 接下来写联表查询的方法，使用循环结构根据层次表顺序向前联合查询，使用merge方法
-    def union_query(self, table_name : str, return_df = False, orient = "split", **kwargs):
-        """向前联表查询"""
-        index = self.order.index(table_name)
-        df = getattr(self, table_name + "_df")
-        for i in range(index-1,-1,-1):
-            # 依次左连接表，并删除多余的id列
-            df = pd.merge(df, getattr(self, self.order[i] + "_df"), left_on=self.name_list[i] + "ID", right_on="id", how="left", suffixes=("", "_drop")).drop(columns=["id_drop"])
-        return self.query(df, return_df, orient, **kwargs)
-    
-    # 写一个获取表字段的方法
-    def get_fields(self, table_name : str):
-        """获取表字段"""
-        df = getattr(self, table_name + "_df")
-        return df.columns.tolist()
-    
-    # 写一个筛选字段的方法（还可以给字段排序）
-    def filter_field(self, df, fields : list, return_df = False, orient = "split"):
-        """筛选字段"""
-        # 判断df是否为dict列表，若是则转换为DataFrame
-        if isinstance(df, list):
-            df = pd.DataFrame(df)
-        # 捕获异常，如果字段不存在，抛出异常
-        try:
-            return df[fields] if return_df else df[fields].to_dict(orient=orient)
-        except KeyError as e:
-           raise self.FieldNotExistError(e.args[0], e.args[1])
-        
 # 下面开发GUI可视化界面
 # 导入一个自定义组件
 class ToolTip:
@@ -364,14 +138,18 @@ class PlaceholderEntry(tk.Entry):
         self.ForceDisabled = flag
 
 class WeatherSysGUI(tk.Tk):
-    def __init__(self):
+    virtual_rows = 1000 # 结果行数超过该值时表格使用虚拟滚动，只生成可见的行
+    reload_interval = 30000 # 只读方式下每隔多少毫秒重新读取数据目录
+
+    def __init__(self, db = None):
+        """db为数据模型，可以是Model或SqliteModel，不指定时先显示窗口，再在后台线程中读取数据创建Model"""
         super().__init__()
         self.title("气象数据管理系统")
         self.width = 1154
         self.height = 1000
         self.geometry("{}x{}".format(self.width, self.height))
         self.resizable(False, False)
-        self.db = Model()
+        self.db = db
         self.eng2chs = {"station": "测量站", "place": "地点", "sensor": "传感器", "record": "测量记录"}
         self.page_eng2chs = {"station": "测量站管理", "place": "地点管理", "sensor": "传感器管理", "record": "测量记录管理"}
         self.page_chs2eng = {"测量站管理": "station", "地点管理": "place", "传感器管理": "sensor", "测量记录管理": "record"}
@@ -379,7 +157,29 @@ class WeatherSysGUI(tk.Tk):
         self.name_list = ["测量站", "地点", "传感器", "测量记录"]
         self.menu_list = []
         self.page_queue = ["测量站管理"] # 用来记录分页的历史记录（仅记录最近三次）
+        self.tree_views = {} # 表格 -> 表格中显示的数据及滚动、选中状态、列宽
+        self.font = tkFont.Font() # 计算文字像素宽度共用的字体
+        # 数据模型的操作都在这个后台线程中依次执行，界面不会卡住
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.task_ids = {} # 任务类别 -> 最新任务的编号，旧任务的结果会被丢弃
+        self.task_counter = itertools.count() # 为不需要丢弃旧结果的任务生成各不相同的类别
+        self.progress_windows = {} # 任务类别 -> 进度窗口
+        # 分页在第一次切换到时才创建控件并查询
+        self.page_inits = {"测量站管理": lambda: self.init_manage_page_ui("station"),
+                           "地点管理": lambda: self.init_manage_page_ui("place"),
+                           "传感器管理": lambda: self.init_manage_page_ui("sensor"),
+                           "测量记录管理": lambda: self.init_manage_page_ui("record"),
+                           "联表查询": self.init_union_search_page_ui,
+                           "统计图表": self.init_chart_page_ui}
+        self.ready_pages = set() # 已经创建的分页
+        self.reload_timer = None # 只读方式下定期重新读取数据的after编号
         self.init_layout()
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        if db is None:
+            # 导入服务等其他程序占用数据目录时以只读方式打开
+            self.run_task("load_model", self.open_model, self.model_loaded)
+        else:
+            self.ensure_page("测量站管理")
 
     def init_layout(self):
         """初始化布局，"""
@@ -400,19 +200,60 @@ class WeatherSysGUI(tk.Tk):
         self.notebook.add(self.record_page, text="测量记录管理")
         self.notebook.add(self.union_search_page, text="联表查询")
         self.notebook.add(self.chart_page, text="统计图表")
-        # 初始化表格分页布局
-        for table_name in self.order:
-            self.init_manage_page_ui(table_name)
-        # 初始化联表查询分页布局
-        self.init_union_search_page_ui()
-        # 初始化统计图表分页布局
-        self.init_chart_page_ui()
-        # 绑定切换分页事件
+        # 绑定切换分页事件，分页的内容在第一次切换到时由ensure_page创建
         self.notebook.bind("<<NotebookTabChanged>>", self.NotebookTabChanged)
         # 绑定左键单击事件，在全局范围内销毁右键菜单
         self.bind("<Button-1>", lambda event: self.destroy_menu())
 
 
+    def close(self):
+        """关闭窗口：等后台任务执行完，再关闭数据模型，把预写日志中的改动写入表文件"""
+        self.withdraw()
+        if self.reload_timer is not None:
+            self.after_cancel(self.reload_timer)
+        self.executor.shutdown(wait=True)
+        if self.db is not None:
+            self.db.close()
+        self.destroy()
+
+    def open_model(self) -> Model:
+        """在后台线程中创建数据模型，数据目录被导入服务等其他程序占用时以只读方式打开"""
+        try:
+            return Model()
+        except Model.DataDirLockedError:
+            return Model(read_only=True)
+
+    def model_loaded(self, db):
+        """后台线程创建好数据模型后，创建当前所在的分页；只读方式下提示用户并定期重新读取数据"""
+        self.db = db
+        self.activate_page(self.notebook.tab(self.notebook.select(), "text"))
+        if getattr(db, "read_only", False):
+            self.title("气象数据管理系统（只读）")
+            tkMessageBox.showinfo("只读模式", "数据目录正由导入服务等其他程序写入，当前只能查询，不能增删改；"
+                                  f"每{self.reload_interval // 1000}秒重新读取一次数据，之后的查询会包含新写入的数据")
+            self.reload_timer = self.after(self.reload_interval, self.reload_model)
+
+    def reload_model(self):
+        """只读方式下在后台线程中重新读取数据目录，完成后安排下一次"""
+        def reloaded(result):
+            self.reload_timer = self.after(self.reload_interval, self.reload_model)
+        self.reload_timer = None
+        self.run_task("reload_model", self.db.reload, reloaded)
+
+    def ensure_page(self, tab_name : str):
+        """分页第一次用到时创建其中的控件，数据模型尚未创建好时等model_loaded再创建"""
+        if self.db is None or tab_name in self.ready_pages:
+            return
+        self.ready_pages.add(tab_name)
+        self.page_inits[tab_name]()
+
+    def activate_page(self, tab_name : str):
+        """切换到tab_name页后，按需创建分页，联表查询页按上一个表格分页更新可用的查询条件"""
+        self.ensure_page(tab_name)
+        if tab_name == "联表查询" and tab_name in self.ready_pages:
+            # 更新联表查询ui
+            self.update_union_search_ui(self.page_chs2eng[self.page_queue[1]])
+
     def init_manage_page_ui(self, table_name):
         """初始化分页布局"""
         # 获得分页对象
@@ -434,6 +275,10 @@ class WeatherSysGUI(tk.Tk):
         # 初始化上下两个部分的布局
         self.init_top_frame_ui(table_name)
         self.init_bottom_frame_ui(table_name)
+        # 分区懒加载模式下，测量记录表默认只显示最近一个分区的记录
+        recent_range = self.db.recent_range() if table_name == "record" else None
+        if recent_range:
+            getattr(self, "record_时间_entry").insert(0, "~".join(recent_range))
         # 更新表格
         self.search(table_name)
 
@@ -465,16 +310,24 @@ class WeatherSysGUI(tk.Tk):
         tree["show"] = "headings"
         # 设置表格大小，使其完全填充table_frame
         tree.place(relwidth=1, relheight=0.99)
-        # 设置表格的垂直滚动条
-        scroll_bar_y = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=tree.yview)
-        tree.configure(yscrollcommand=scroll_bar_y.set)
+        # 设置表格的垂直滚动条，虚拟滚动时由滚动条决定显示哪些行
+        scroll_bar_y = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=lambda *args: self.tree_yview(tree, *args))
+        tree.configure(yscrollcommand=lambda first, last: self.tree_yscroll(tree, first, last))
         scroll_bar_y.place(relx=1, relheight=1, anchor=tk.NE)
+        self.tree_views[tree] = {"df": pd.DataFrame(), "first": 0, "virtual": False, "selected": None, "extend": None, "scroll_bar": scroll_bar_y, "widths": None}
         # 设置表格的水平滚动条
         scroll_bar_x = ttk.Scrollbar(table_frame, orient=tk.HORIZONTAL, command=tree.xview)
         tree.configure(xscrollcommand=scroll_bar_x.set)
         scroll_bar_x.place(rely=1, relwidth=1, anchor=tk.SW)
         # 响应鼠标滚轮事件，垂直滚动
-        tree.bind("<MouseWheel>", lambda event: tree.yview_scroll(int(-1 * (event.delta / 120)), "units"))
+        tree.bind("<MouseWheel>", lambda event: self.tree_yview(tree, "scroll", int(-1 * (event.delta / 120)), "units") or "break")
+        # X11上的Tk 8.6用Button-4/5表示滚轮向上/向下
+        tree.bind("<Button-4>", lambda event: self.tree_yview(tree, "scroll", -1, "units") or "break")
+        tree.bind("<Button-5>", lambda event: self.tree_yview(tree, "scroll", 1, "units") or "break")
+        # 虚拟滚动时记录选中状态，窗口大小变化时重新生成可见的行
+        tree.bind("<ButtonPress-1>", lambda event: self.tree_pressed(tree, event))
+        tree.bind("<<TreeviewSelect>>", lambda event: self.tree_selected(tree))
+        tree.bind("<Configure>", lambda event: self.tree_views[tree]["virtual"] and self.render_tree(tree))
         # 相应<Control-c>事件
         tree.bind('<Control-c>', lambda event: self.copy_cell_value(tree))
         # 相应<Control-a>事件
@@ -485,24 +338,148 @@ class WeatherSysGUI(tk.Tk):
         tree.bind("<ButtonRelease-1>", lambda event: self.destroy_menu())
 
     # 写一个更新表格的方法，用于增删改查后更新表格
-    def update_tree(self, tree : ttk.Treeview, headers : list, data : list, do_not_resize : bool = False):
-        """更新表格，headers是表头列表，data是二维数据列表"""
-        # 先删除原有的数据
-        tree.delete(*tree.get_children())
+    def update_tree(self, tree : ttk.Treeview, headers : list, data, do_not_resize : bool = False):
+        """
+        更新表格，headers是表头列表，data是二维数据列表或DataFrame
+        行数超过virtual_rows时使用虚拟滚动，表格中只生成可见的几行，滚动时从DataFrame中取出对应的行重新生成
+        """
+        df = data.reset_index(drop=True) if isinstance(data, pd.DataFrame) else pd.DataFrame(data, columns=headers)
+        view = self.tree_views[tree]
+        view.update(df=df, first=0, virtual=len(df) > self.virtual_rows, extend=None, widths=None)
+        # 虚拟滚动时选中状态按行号保存，不在可见范围内的行也能保持选中
+        view["selected"] = np.zeros(len(df), dtype=bool) if view["virtual"] else None
         # 更新表头
         tree["columns"] = headers
         for col in headers:  # 绑定函数，使表头可排序
             tree.heading(col, text=col, command=lambda _col=col: self.treeview_sort_column(tree, _col, False))
-        # 用二层循环向表格中添加数据
-        for i in range(len(data)):
-            tree.insert("", i, values=data[i])
+        self.render_tree(tree)
         # 将各列设置为水平居中
         for column in tree["columns"]:
             tree.column(column, anchor=tk.CENTER)
         # 将列宽调整为那一列中最宽的单元格的宽度（自适应列宽）
         if not do_not_resize:
-            for i, column in enumerate(headers):
-                tree.column(column, width=tkFont.Font().measure(max([column]+[row[i] for row in data], key=lambda x: len(str(x)))))
+            for column, width in self.column_widths(tree).items():
+                tree.column(column, width=width)
+
+    def column_widths(self, tree : ttk.Treeview) -> dict:
+        """计算各列宽度，即表头与该列最长的单元格中较长者的像素宽度，结果缓存到表格数据变化为止"""
+        view = self.tree_views[tree]
+        if view["widths"] is None:
+            df = view["df"]
+            view["widths"] = {column: self.font.measure(max(str(column), self.widest_text(df[column]), key=len)) for column in df.columns}
+        return view["widths"]
+
+    @staticmethod
+    def widest_text(values : pd.Series) -> str:
+        """
+        找出一列中转换为字符串后最长的值，按字段类型向量化计算：
+        整数只需比较最小值和最大值，时间格式长度固定，category只比较各类别，其余类型超过1万行时等距抽样1万行
+        """
+        values = values.dropna()
+        if values.empty:
+            return ""
+        if pd.api.types.is_integer_dtype(values.dtype):
+            texts = pd.Series([str(values.min()), str(values.max())])
+        elif pd.api.types.is_datetime64_any_dtype(values.dtype):
+            texts = pd.Series([str(values.iloc[0])])
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            texts = pd.Series(values.cat.categories).astype(str)
+        else:
+            if len(values) > 10000:
+                values = values.iloc[np.linspace(0, len(values) - 1, 10000).astype("int64")]
+            texts = values.astype(str)
+        return texts.iloc[int(texts.str.len().to_numpy().argmax())]
+
+    def render_tree(self, tree : ttk.Treeview):
+        """重新生成表格中的行，行的iid为该行在DataFrame中的行号"""
+        view = self.tree_views[tree]
+        df = view["df"]
+        tree.delete(*tree.get_children())
+        if not view["virtual"]:
+            for i, row in enumerate(df.itertuples(index=False)):
+                tree.insert("", i, iid=str(i), values=list(row))
+            return
+        count = self.visible_rows(tree)
+        first = view["first"] = max(0, min(view["first"], len(df) - count))
+        for i, row in enumerate(df.iloc[first:first + count].itertuples(index=False), first):
+            tree.insert("", "end", iid=str(i), values=list(row))
+        # selection_set产生的<<TreeviewSelect>>只反映已保存的选中状态，不能当作一次点击而清掉不可见行的选中（如排序后）
+        view["extend"] = None
+        tree.selection_set([str(i) for i in np.flatnonzero(view["selected"][first:first + count]) + first])
+        tree.yview_moveto(0)
+        view["scroll_bar"].set(first / len(df), min(first + count, len(df)) / len(df))
+
+    def visible_rows(self, tree : ttk.Treeview) -> int:
+        """估算表格一屏能显示的行数，多算一行作为缓冲"""
+        rowheight = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        # 减去表头的高度
+        return max((tree.winfo_height() - rowheight) // rowheight, 1) + 1
+
+    def tree_yview(self, tree : ttk.Treeview, *args):
+        """滚动条与鼠标滚轮的滚动命令，虚拟滚动时移动第一行的位置后重新生成可见的行"""
+        view = self.tree_views[tree]
+        if not view["virtual"]:
+            tree.yview(*args)
+            return
+        count = self.visible_rows(tree)
+        if args[0] == "moveto":
+            first = int(float(args[1]) * len(view["df"]))
+        else:
+            first = view["first"] + int(args[1]) * (count - 1 if args[2] == "pages" else 1)
+        if first != view["first"]:
+            view["first"] = first
+            self.render_tree(tree)
+
+    def tree_yscroll(self, tree : ttk.Treeview, first, last):
+        """表格滚动后同步滚动条，虚拟滚动时滚动条由render_tree设置"""
+        view = self.tree_views[tree]
+        if not view["virtual"]:
+            view["scroll_bar"].set(first, last)
+
+    def tree_pressed(self, tree : ttk.Treeview, event):
+        """
+        记录鼠标点击行时是否按住Shift或Ctrl，不按时点击会取消其他行的选中
+        点击表头和空白处不会改变选中，也就不会产生<<TreeviewSelect>>，不记录
+        """
+        if tree.identify_region(event.x, event.y) in ("cell", "tree"):
+            self.tree_views[tree]["extend"] = bool(event.state & 0x0005)
+
+    def tree_selected(self, tree : ttk.Treeview):
+        """
+        虚拟滚动时把可见行的选中状态同步到按行号保存的选中状态
+        只有点击行（extend不为None）时才取消不可见行的选中，键盘操作和重新生成行引起的选中变化只同步可见的行
+        """
+        view = self.tree_views[tree]
+        if not view["virtual"]:
+            return
+        selected = view["selected"]
+        if view["extend"] is False:
+            selected[:] = False
+        children = tree.get_children()
+        if children:
+            selected[int(children[0]):int(children[-1]) + 1] = False
+        selected[[int(item) for item in tree.selection()]] = True
+        view["extend"] = None
+
+    def tree_selection(self, tree : ttk.Treeview) -> list:
+        """获取所有选中行的值列表，包括虚拟滚动时不在可见范围内的行"""
+        view = self.tree_views[tree]
+        if view["virtual"]:
+            positions = np.flatnonzero(view["selected"])
+        else:
+            positions = sorted(int(item) for item in tree.selection())
+        return view["df"].iloc[positions].values.tolist()
+
+    def select_tree_rows(self, tree : ttk.Treeview, positions):
+        """选中DataFrame中给定行号的行"""
+        view = self.tree_views[tree]
+        if view["virtual"]:
+            view["selected"][:] = False
+            view["selected"][positions] = True
+            children = tree.get_children()
+            first = int(children[0]) if children else 0
+            positions = np.flatnonzero(view["selected"][first:first + len(children)]) + first
+        tree.selection_set([str(i) for i in positions])
 
     def init_bottom_frame_ui(self, table_name):
         """
@@ -539,10 +516,10 @@ class WeatherSysGUI(tk.Tk):
         # 获取表的字段名
         fields = self.db.get_fields(table_name)
         # 获取每个字段标题的文字宽度，并计算所有字段标题文字总宽度，再将每个字段文字宽度除以总宽度，得到每个字段的宽度占比，再乘上窗体宽度，得到每列宽度
-        fields_width = [tkFont.Font().measure(field) for field in fields]
+        fields_width = [self.font.measure(field) for field in fields]
         total_width = sum(fields_width)
         # 获取单个文字的宽度，以0的宽度为准，因为entry控件的width的单位是字符数，而不是像素数
-        single_width = tkFont.Font().measure("0")
+        single_width = self.font.measure("0")
         widths = [int(width / total_width * (self.width / single_width)*1.1) for width in fields_width]
         for i in range(len(fields)):
             # 创建标题行
@@ -583,8 +560,8 @@ class WeatherSysGUI(tk.Tk):
             entry = getattr(self, table_name + "_" + field + "_entry")
             entry.delete(0, tk.END)
     
-    def search(self, table_name):
-        """查询"""
+    def search(self, table_name, on_done = None):
+        """查询，查询在后台线程中执行，结果显示到表格后再调用on_done"""
         # 获取输入区域字段字典，如果entry的值不为空，且未被禁用，则将其加入到字典中
         fields = self.db.get_fields(table_name)
         fields_dict = {}
@@ -599,12 +576,15 @@ class WeatherSysGUI(tk.Tk):
                 else:
                     res = str_to_num(res)
                 fields_dict[field] = res
-        # 查询
-        result = self.db.query(table_name, **fields_dict)["data"]
         # 获取表格对象
         tree = getattr(self, table_name + "_tree")
-        # 将查询结果显示到表格中
-        self.update_tree(tree, fields, result)
+        def show(result):
+            # 将查询结果显示到表格中
+            self.update_tree(tree, fields, result)
+            if on_done is not None:
+                on_done()
+        # 查询，同一页面发起新的查询后旧查询的结果会被丢弃
+        self.run_task(table_name + "_search", lambda: self.db.query(table_name, return_df=True, **fields_dict), show, cancellable=True)
 
     def insert(self, table_name):
         """增加"""
@@ -620,35 +600,30 @@ class WeatherSysGUI(tk.Tk):
             else:
                 tkMessageBox.showwarning("警告", f"\"{field}\"不能为空")
                 return
-        # 增加记录，同时处理self.db.ForeignKeyNotExistError异常
-        try:
-            self.db.insert(table_name, **fields_dict)
-        except self.db.ForeignKeyNotExistError as e:
-            tkMessageBox.showwarning("引用外键不存在", str(e))
-            return
-        # 清空输入区域
-        self.clear_input_frame(table_name)
-        # 调用search方法
-        self.search(table_name)
-        # 增加后自动选中最后一行
         tree = getattr(self, table_name + "_tree")
-        tree.selection_set(tree.get_children()[-1])
+        def inserted(result):
+            # 新的测量记录实时追加到图表中该传感器的折线上
+            if table_name == "record":
+                self.append_chart_points(fields_dict["传感器ID"], pd.to_datetime([fields_dict["时间"]]).to_numpy(), [fields_dict["测量值"]])
+            # 清空输入区域
+            self.clear_input_frame(table_name)
+            # 调用search方法，增加后自动选中最后一行
+            self.search(table_name, lambda: self.select_tree_rows(tree, [len(self.tree_views[tree]["df"]) - 1]))
+        # 增加记录，同时处理self.db.ForeignKeyNotExistError异常
+        self.run_task(None, lambda: self.db.insert(table_name, **fields_dict), inserted, {self.db.ForeignKeyNotExistError: "引用外键不存在", Model.ReadOnlyError: "只读模式"})
         
     def delete(self, table_name):
         """从treeview中拿到所有选中项的id，组成列表，然后删除"""
         # 获取选中项的id
         treeview = getattr(self, table_name + "_tree")
-        ids = [treeview.item(item)["values"][0] for item in treeview.selection()]
+        ids = [row[0] for row in self.tree_selection(treeview)]
+        def deleted(result):
+            # 清空输入区域
+            self.clear_input_frame(table_name)
+            # 调用search方法
+            self.search(table_name)
         # 删除，并捕获DelReferentialIntegrityError异常
-        try:
-            self.db.delete(table_name, ids)
-        except self.db.DelReferentialIntegrityError as e:
-            tkMessageBox.showwarning("违反参照完整性", str(e))
-            return
-        # 清空输入区域
-        self.clear_input_frame(table_name)
-        # 调用search方法
-        self.search(table_name)
+        self.run_task(None, lambda: self.db.delete(table_name, ids), deleted, {self.db.DelReferentialIntegrityError: "违反参照完整性", Model.ReadOnlyError: "只读模式"})
     
     def updated(self, table_name):
         """修改"""
@@ -662,23 +637,80 @@ class WeatherSysGUI(tk.Tk):
                 fields_dict[field] = str_to_num(entry.get())
         # 获取选中项的id
         treeview = getattr(self, table_name + "_tree")
-        ids = [treeview.item(item)["values"][0] for item in treeview.selection()]
-        # 修改，并捕获self.db.ForeignKeyNotExistError异常
-        for id in ids:
-            try:
-                self.db.update(table_name, id, **fields_dict)
-            except self.db.ForeignKeyNotExistError as e:
-                tkMessageBox.showwarning("引用外键不存在", str(e))
+        ids = [row[0] for row in self.tree_selection(treeview)]
+        def updated(result):
+            # 清空输入区域
+            self.clear_input_frame(table_name)
+            # 调用search方法，修改后自动选中修改的那几行
+            ## 选中id在ids中的行
+            self.search(table_name, lambda: self.select_tree_rows(treeview, np.flatnonzero(self.tree_views[treeview]["df"]["id"].isin(ids))))
+        # 所有选中行一次修改、只持久化一次，并捕获self.db.ForeignKeyNotExistError异常
+        self.run_task(None, lambda: self.db.update(table_name, ids, **fields_dict), updated, {self.db.ForeignKeyNotExistError: "引用外键不存在", Model.ReadOnlyError: "只读模式"})
+
+    def run_task(self, key : str, func, on_done, errors : dict = None, cancellable : bool = False):
+        """
+        在后台线程中执行数据模型操作func，完成后用after回到界面线程，以func的返回值调用on_done
+        key为任务类别，同一类别发起新任务后旧任务的结果被丢弃，为None时结果总会处理（增删改）；errors为{异常类: 警告标题}，这些异常弹出警告
+        任务超过0.3秒未完成时显示进度窗口，cancellable为True时可以取消（只丢弃结果，已经开始的操作仍会执行完）
+        """
+        if key is None:
+            key = "task_%d" % next(self.task_counter)
+        task_id = self.task_ids.get(key, 0) + 1
+        self.task_ids[key] = task_id
+        future = self.executor.submit(func)
+        self.after(50, self.poll_task, key, task_id, future, on_done, errors or {}, cancellable, time.perf_counter())
+
+    def poll_task(self, key : str, task_id : int, future, on_done, errors : dict, cancellable : bool, started : float):
+        """在界面线程中检查后台任务是否完成"""
+        if self.task_ids[key] != task_id:
+            # 已被取消或有更新的同类任务，尚未开始时直接取消
+            future.cancel()
+            return
+        if not future.done():
+            if time.perf_counter() - started > 0.3:
+                self.show_progress(key, cancellable)
+            self.after(50, self.poll_task, key, task_id, future, on_done, errors, cancellable, started)
+            return
+        self.hide_progress(key)
+        error = future.exception()
+        if error is None:
+            on_done(future.result())
+            return
+        for error_type, title in errors.items():
+            if isinstance(error, error_type):
+                tkMessageBox.showwarning(title, str(error))
                 return
-        # 清空输入区域
-        self.clear_input_frame(table_name)
-        # 调用search方法
-        self.search(table_name)
-        # 修改后自动选中修改的那几行
-        ## 遍历每一行，若id在ids中，则选中该行
-        for item in treeview.get_children():
-            if treeview.item(item)["values"][0] in ids:
-                treeview.selection_add(item)
+        tkMessageBox.showerror("错误", f"{type(error).__name__}: {error}")
+
+    def cancel_task(self, key : str):
+        """取消key类别正在进行的任务，丢弃其结果"""
+        self.task_ids[key] = self.task_ids.get(key, 0) + 1
+        self.hide_progress(key)
+
+    def show_progress(self, key : str, cancellable : bool):
+        """显示任务的进度窗口"""
+        if key in self.progress_windows:
+            return
+        window = tk.Toplevel(self)
+        window.title("请稍候")
+        window.transient(self)
+        window.resizable(False, False)
+        tk.Label(window, text="正在处理，请稍候……").pack(padx=20, pady=(15, 5))
+        progress_bar = ttk.Progressbar(window, mode="indeterminate", length=240)
+        progress_bar.pack(padx=20, pady=5)
+        progress_bar.start(10)
+        if cancellable:
+            tk.Button(window, text="取消", command=lambda: self.cancel_task(key)).pack(pady=(5, 15))
+            window.protocol("WM_DELETE_WINDOW", lambda: self.cancel_task(key))
+        else:
+            window.protocol("WM_DELETE_WINDOW", lambda: None)
+        self.progress_windows[key] = window
+
+    def hide_progress(self, key : str):
+        """关闭任务的进度窗口"""
+        window = self.progress_windows.pop(key, None)
+        if window is not None:
+            window.destroy()
 
 
 
@@ -791,8 +823,9 @@ class WeatherSysGUI(tk.Tk):
             return
         # 获得分页名称
         page_name = self.page_eng2chs[table_name]
-        # 切换分页
+        # 切换分页，分页第一次打开时先创建其中的控件
         self.changeTab(page_name)
+        self.ensure_page(page_name)
         # 获得联表的treeview
         treeview = getattr(self, "union_search_result_table")
         # 变换字段
@@ -802,7 +835,7 @@ class WeatherSysGUI(tk.Tk):
             zd = self.eng2chs[table_name] + "ID"
         i = treeview["columns"].index(zd)
         # 获得值
-        ids = [str(treeview.item(item)["values"][i]) for item in treeview.selection()]
+        ids = [str(row[i]) for row in self.tree_selection(treeview)]
         # ids去重
         ids = list(set(ids))
         # 拼接查询语句
@@ -813,14 +846,12 @@ class WeatherSysGUI(tk.Tk):
         self.clear_input_frame(table_name)
         # 插入查询语句
         entry.insert(0, search_str)
-        # 调用查询方法
-        self.search(table_name)
-        # 禁用输入框
-        entry["state"] = tk.DISABLED
         # 获得对应表tree
         tree = getattr(self, table_name + "_tree")
-        # 全选
-        tree.selection_set(tree.get_children())
+        # 调用查询方法，查询完成后全选
+        self.search(table_name, lambda: self.select_all(tree))
+        # 禁用输入框
+        entry["state"] = tk.DISABLED
 
     def toggle_union_search_input_entry(self, table_name, state : bool):
         """切换对应表的输入区域的输入框状态"""
@@ -881,13 +912,14 @@ class WeatherSysGUI(tk.Tk):
                     else:
                         res = str_to_num(res)
                     input_dict[widget.placeholder] = res
-        # 调用model的联表查询方法
-        result = self.db.union_query(table_name, **input_dict)
-        # 更新表格
-        self.update_tree(getattr(self,"union_search_result_table"),result["columns"],result["data"],do_not_resize=True)
+        # 在后台线程中调用model的联表查询方法，完成后更新表格
+        self.run_task("union_search", lambda: self.db.union_query(table_name, return_df=True, **input_dict),
+                      lambda result: self.update_tree(getattr(self,"union_search_result_table"),result.columns.tolist(),result,do_not_resize=True), cancellable=True)
 
     def init_chart_page_ui(self):
-        """将matplotlib绘制的图表显示到界面上"""
+        """将matplotlib绘制的图表显示到界面上，第一次打开统计图表页时才导入matplotlib"""
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        from matplotlib.figure import Figure
         # 创建画布
         self.fig = Figure(figsize=(10, 8), dpi=100)
         # 创建子图
@@ -899,53 +931,146 @@ class WeatherSysGUI(tk.Tk):
         self.toolbar = NavigationToolbar2Tk(self.canvas, self.chart_page)
         self.toolbar.update()
         self.canvas._tkcanvas.pack(fill=tk.BOTH, expand=True)
+        # 每个传感器一条折线，之后只更新折线的数据，不再清空子图重建
+        self.chart_lines = {} # 传感器ID -> Line2D
+        self.chart_data = {} # 传感器ID -> (按x排序的x值, y值, x值对应的matplotlib坐标)
+        self.chart_labels = (None, None)
+        # 缩放、平移时按新的x轴范围重新降采样
+        self.ax.callbacks.connect("xlim_changed", self.resample_chart)
 
     def draw_record_line(self, event):
-        """获取被选中的测量记录数据,调用refresh_chart绘制折线图"""
+        """获取被选中的测量记录数据,按传感器分组后调用refresh_chart绘制折线图"""
+        self.ensure_page("统计图表")
         treeview = getattr(self, "record_tree")
-        # 获取被选中的记录的时间
-        datetimes = [treeview.item(item)["values"][1] for item in treeview.selection()]
-        # 获取被选中的记录的测量值
-        values = [float(treeview.item(item)["values"][2]) for item in treeview.selection()]
+        # 获取被选中的记录的时间、测量值、传感器ID
+        selected = pd.DataFrame([row[1:4] for row in self.tree_selection(treeview)], columns=["时间", "测量值", "传感器ID"])
+        selected["时间"] = pd.to_datetime(selected["时间"])
+        data = {sensor_id: (group["时间"].to_numpy(), group["测量值"].astype("float64").to_numpy()) for sensor_id, group in selected.groupby("传感器ID")}
         # 调用refresh_chart绘制折线图
-        self.refresh_chart((datetimes, values), "time", "measure_value")
+        self.refresh_chart(data, "time", "measure_value")
         
     def refresh_chart(self, data, x : str, y : str):
-        """更新折线图,其中data是列表元组,元组中有两个列表,分别代表x的值和y的值"""
-        # 清空子图
-        self.ax.clear()
-        # 绘制折线图
-        self.ax.plot(data[0], data[1])
+        """
+        更新折线图,其中data是列表元组,元组中有两个列表,分别代表x的值和y的值；
+        data也可以是{传感器ID: 列表元组}，每个传感器画一条折线
+        已有的折线只用set_data更新数据，坐标轴范围变化时才重新设置刻度
+        """
+        series = data if isinstance(data, dict) else {None: data}
+        # 去掉不再显示的折线
+        for key in list(self.chart_lines):
+            if key not in series:
+                self.chart_lines.pop(key).remove()
+                self.chart_data.pop(key)
+        for key, (xs, ys) in series.items():
+            self.set_chart_data(key, xs, ys)
+            if key not in self.chart_lines:
+                self.chart_lines[key], = self.ax.plot(self.chart_data[key][0][:0], [], label=f"sensor {key}")
         # 设置标签
-        self.ax.set_xlabel(x)
-        self.ax.set_ylabel(y)
-        
-        # 获取y轴的最大值和最小值
-        y_max = max(data[1])
-        y_min = min(data[1])
-        # 设置y轴的刻度
-        self.ax.set_yticks(np.linspace(y_min, y_max, 10))
+        if (x, y) != self.chart_labels:
+            self.ax.set_xlabel(x)
+            self.ax.set_ylabel(y)
+            self.chart_labels = (x, y)
+        legend = self.ax.get_legend()
+        if len(self.chart_lines) > 1:
+            self.ax.legend()
+        elif legend is not None:
+            legend.remove()
         
         # 解决中文乱码问题
         # self.ax.set_xlabel(x, fontproperties=font)
         # self.ax.set_ylabel(y, fontproperties=font)
         # 绘制图形
-        self.canvas.draw()
+        self.update_chart_view()
+
+    def set_chart_data(self, key, xs, ys):
+        """保存一条折线的全部点，按x排序，并算出x值对应的matplotlib坐标"""
+        xs, ys, keys = self.sort_chart_points(xs, ys)
+        self.chart_data[key] = (xs, ys, keys)
+
+    @staticmethod
+    def sort_chart_points(xs, ys) -> tuple:
+        """把点按x排序，返回x值、y值与x值对应的matplotlib坐标，用于与x轴范围直接比较"""
+        from matplotlib.dates import date2num
+        xs = np.asarray(xs)
+        ys = np.asarray(ys, dtype="float64")
+        order = np.argsort(xs, kind="stable")
+        xs, ys = xs[order], ys[order]
+        keys = date2num(xs) if np.issubdtype(xs.dtype, np.datetime64) else xs.astype("float64")
+        return xs, ys, keys
+
+    def update_chart_view(self):
+        """按全部点自动调整坐标轴范围，范围变化时重设y轴刻度，然后重绘画布"""
+        limits = (self.ax.get_xlim(), self.ax.get_ylim())
+        self.ax.set_autoscale_on(True)
+        self.ax.ignore_existing_data_limits = True
+        for xs, ys, keys in self.chart_data.values():
+            if len(keys):
+                self.ax.update_datalim(np.column_stack([keys[[0, -1]], [np.nanmin(ys), np.nanmax(ys)]]))
+        self.ax.autoscale_view()
+        if (self.ax.get_xlim(), self.ax.get_ylim()) != limits:
+            ys = np.concatenate([data[1] for data in self.chart_data.values()]) if self.chart_data else []
+            if len(ys):
+                # 设置y轴的刻度
+                self.ax.set_yticks(np.linspace(np.nanmin(ys), np.nanmax(ys), 10))
+        else:
+            # x轴范围没有变化时回调不会重新降采样，手动更新折线
+            self.resample_chart(self.ax)
+        self.canvas.draw_idle()
+
+    def append_chart_points(self, key, xs, ys):
+        """
+        实时追加测量值：新点都在该折线最后一个点之后且在当前坐标轴范围内时，
+        只把新增的线段画到画布上并blit，否则更新数据后按新的范围整体重绘
+        """
+        if "统计图表" not in self.ready_pages or key not in self.chart_data:
+            return
+        from matplotlib.lines import Line2D
+        old_xs, old_ys, old_keys = self.chart_data[key]
+        xs, ys, keys = self.sort_chart_points(xs, ys)
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        if not len(old_keys) or keys[0] < old_keys[-1] or keys[-1] > x_max or ys.min() < y_min or ys.max() > y_max:
+            self.set_chart_data(key, np.concatenate([old_xs, xs]), np.concatenate([old_ys, ys]))
+            self.update_chart_view()
+            return
+        # 新点都在原有点之后，直接接在末尾，无需重新排序
+        self.chart_data[key] = (np.concatenate([old_xs, xs]), np.concatenate([old_ys, ys]), np.concatenate([old_keys, keys]))
+        line = self.chart_lines[key]
+        line.set_data(np.concatenate([line.get_xdata(), xs]), np.concatenate([line.get_ydata(), ys]))
+        # 只画新增的线段（从原来的最后一个点连到新点），其余部分保持不变
+        segment = Line2D(np.r_[old_keys[-1], keys], np.r_[old_ys[-1], ys])
+        segment.update_from(line)
+        self.ax.draw_artist(segment)
+        self.canvas.blit(self.ax.bbox)
+
+    def chart_width(self) -> int:
+        """获取子图的像素宽度"""
+        return max(int(self.ax.get_window_extent().width), 1)
+
+    def resample_chart(self, ax):
+        """x轴范围变化后，只对范围内的点重新降采样，画布随后由改变范围的一方重绘"""
+        x_min, x_max = ax.get_xlim()
+        for key, (xs, ys, keys) in self.chart_data.items():
+            # 两边各多保留一个点，使折线延伸到边界之外
+            left = max(np.searchsorted(keys, x_min, side="left") - 1, 0)
+            right = np.searchsorted(keys, x_max, side="right") + 1
+            shown = left + m4_downsample(keys[left:right], ys[left:right], self.chart_width())
+            self.chart_lines[key].set_data(xs[shown], ys[shown])
 
 # 响应快捷键
 
     def copy_cell_value(self, tree : ttk.Treeview):
         """弹出一个选择复制单元格的窗口"""
         # 获取选中行
-        selected_items = tree.selection()
+        selected_rows = self.tree_selection(tree)
         # 判断是否大于一行
-        if len(selected_items) > 1:
+        if len(selected_rows) > 1:
             tkMessageBox.showwarning("警告", "只能选择一个单元格")
             # 清除选中状态
-            tree.selection_remove(selected_items)
+            self.select_tree_rows(tree, [])
             return
         # 获取选中行的值列表
-        values = [str(s) for s in tree.item(selected_items[0])["values"]]
+        values = [str(s) for s in selected_rows[0]]
         allow_copy_window = tk.Toplevel(self)
         # 根据values列表在一行内创建多个按钮，每个按钮的标签为value的值，宽度为value的文本宽度
         btn_list = []
@@ -961,22 +1086,43 @@ class WeatherSysGUI(tk.Tk):
 
     def copy_value(self, value, window):
         """复制value的值到剪贴板，并关闭窗口"""
+        import clipboard
         clipboard.copy(value)
         window.destroy()
 
     def select_all(self, tree : ttk.Treeview):
         """选中所有行"""
-        tree.selection_set(tree.get_children())
+        self.select_tree_rows(tree, np.arange(len(self.tree_views[tree]["df"])))
 
     def treeview_sort_column(self, tv, col, reverse):  # Treeview、列名、排列方式
-        """按列排序函数"""
-        l = [(tv.set(k, col), k) for k in tv.get_children('')]
-        l.sort(reverse=reverse, key=lambda x: str_to_num(x[0]))  # 排序方式
-        # rearrange items in sorted positions
-        for index, (val, k) in enumerate(l):  # 根据排序后索引移动
-            tv.move(k, '', index)
+        """按列排序函数：对表格对应的DataFrame稳定排序后重新生成表格，选中的行保持选中"""
+        view = self.tree_views[tv]
+        df = view["df"].sort_values(col, ascending=not reverse, kind="stable", key=self.sort_key)
+        # order[i]是排序后第i行原来的行号
+        order = df.index.to_numpy()
+        positions = np.empty(len(order), dtype="int64")
+        positions[order] = np.arange(len(order))
+        selected = view["selected"][order] if view["virtual"] else positions[[int(item) for item in tv.selection()]]
+        view["df"] = df.reset_index(drop=True)
+        if view["virtual"]:
+            view["selected"] = selected
+            self.render_tree(tv)
+        else:
+            self.render_tree(tv)
+            self.select_tree_rows(tv, selected)
         tv.heading(col, command=lambda: self.treeview_sort_column(tv, col, not reverse))  # 重写标题，使之成为再点倒序的标题
 
+    @staticmethod
+    def sort_key(values : pd.Series) -> pd.Series:
+        """排序时使用的值：category按类别的值排序，全部是数字的字符串按数字排序，其余类型（包括时间）直接排序"""
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values.astype(object)
+        if values.dtype == object:
+            numbers = pd.to_numeric(values, errors="coerce")
+            if numbers.notna().sum() == values.notna().sum():
+                return numbers
+        return values
+
     def destroy_menu(self):
         """销毁所有菜单"""
         for menu in self.menu_list:
@@ -1030,11 +1176,10 @@ class WeatherSysGUI(tk.Tk):
         displaycolumns = tuple(c for c in displaycolumns if c != column)
         # 设置tree的displaycolumns
         tree["displaycolumns"] = displaycolumns
-        # 将列宽调整为那一列中最宽的单元格的宽度（自适应列宽）
+        # 将列宽调整为那一列中最宽的单元格的宽度（自适应列宽），使用缓存的列宽
         if not do_not_resize:
-            headers, data = self.get_treeview_data(tree)
-            for i, column in enumerate(columns):
-                tree.column(column, width=tkFont.Font().measure(max([column]+[row[i] for row in data], key=lambda x: len(str(x)))))
+            for column, width in self.column_widths(tree).items():
+                tree.column(column, width=width)
 
 
     def show_column(self, tree : ttk.Treeview, column : str, do_not_resize : bool = False):
@@ -1047,27 +1192,14 @@ class WeatherSysGUI(tk.Tk):
             if c == column or c in displaycolumns:
                 new_displaycolumns.append(c)
         new_displaycolumns = tuple(new_displaycolumns)
-        headers, data = self.get_treeview_data(tree)
         if new_displaycolumns == columns:
             new_displaycolumns = ("#all",)
-            headers = columns
         # 设置tree的displaycolumns
         tree["displaycolumns"] = new_displaycolumns
-        # 将列宽调整为那一列中最宽的单元格的宽度（自适应列宽）
+        # 将列宽调整为那一列中最宽的单元格的宽度（自适应列宽），使用缓存的列宽
         if not do_not_resize:
-            for i, column in enumerate(headers):
-                tree.column(column, width=tkFont.Font().measure(max([column]+[row[i] for row in data], key=lambda x: len(str(x)))))
-
-    def get_treeview_data(self, tree : ttk.Treeview):
-        """获取columns与二维列表data"""
-        # 获取columns
-        columns = tree["columns"]
-        # 获取data
-        data = []
-        for item in tree.get_children():
-            values = [tree.set(item, column) for column in columns]
-            data.append(values)
-        return columns, data
+            for column, width in self.column_widths(tree).items():
+                tree.column(column, width=width)
 
     def NotebookTabChanged(self, event):
         """Notebook页改变事件"""
@@ -1078,11 +1210,7 @@ class WeatherSysGUI(tk.Tk):
         # 如果self.page_queue的长度大于3，则删除第一个元素
         if len(self.page_queue) > 3:
             self.page_queue.pop(0)
-        last_tab = self.page_queue[1]
-        # 判断current_tab是否为联表查询
-        if current_tab == "联表查询":
-            # 更新联表查询ui
-            self.update_union_search_ui(self.page_chs2eng[last_tab])
+        self.activate_page(current_tab)
 
     def changeTab(self, tab_name : str):
         """切换到tab_name页"""
@@ -1098,23 +1226,28 @@ class WeatherSysGUI(tk.Tk):
 
 if __name__ == "__main__":
     # 给表添加测试数据
-    data_dir = os.path.join(current_path, "data")
     # 如果数据文件不存在，就添加记录
     import random, string
+    db = None
     if not os.path.exists(data_dir):
         db = Model()
+        stations, places, sensors, records = [], [], [], []
         for i in range(40):
             station_name = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-            db.insert("station", 测量站名称=station_name, 代表地区="南京信息工程大学", 测量站状态="上线")
+            stations.append(dict(测量站名称=station_name, 代表地区="南京信息工程大学", 测量站状态="上线"))
             place_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            db.insert("place", 地点编号=place_id, 经度=random.uniform(118.0, 119.0), 纬度=random.uniform(31.0, 33.0), 海拔=random.uniform(0, 1000), 地点状态="上线", 测量站ID=0)
+            places.append(dict(地点编号=place_id, 经度=random.uniform(118.0, 119.0), 纬度=random.uniform(31.0, 33.0), 海拔=random.uniform(0, 1000), 地点状态="上线", 测量站ID=0))
             sensor_type = random.choice(["温度传感器", "湿度传感器", "气压传感器"])
             sensor_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            db.insert("sensor", 传感器类型=sensor_type, 测量值单位=random.choice(["℃", "%", "kPa"]), 传感器编号=sensor_id, 上线时间="2023-06-05", 下线时间="2027-06-05", 传感器状态="上线", 地点ID=0)
-            db.insert("record", 时间="2023-06-05 12:00:00", 测量值=random.uniform(20, 30), 传感器ID=0)
-            db.insert("record", 时间="2023-06-05 13:00:00", 测量值=random.uniform(20, 30), 传感器ID=0)
-            db.insert("record", 时间="2023-06-05 14:00:00", 测量值=random.uniform(20, 30), 传感器ID=0)
-            db.insert("record", 时间="2023-06-05 15:00:00", 测量值=random.uniform(20, 30), 传感器ID=0)
+            sensors.append(dict(传感器类型=sensor_type, 测量值单位=random.choice(["℃", "%", "kPa"]), 传感器编号=sensor_id, 上线时间="2023-06-05", 下线时间="2027-06-05", 传感器状态="上线", 地点ID=0))
+            for hour in range(12, 16):
+                records.append(dict(时间=f"2023-06-05 {hour}:00:00", 测量值=random.uniform(20, 30), 传感器ID=0))
+        # 按层级顺序批量插入
+        db.insert_many("station", stations)
+        db.insert_many("place", places)
+        db.insert_many("sensor", sensors)
+        db.insert_many("record", records)
 
-    app = WeatherSysGUI()
+    # 数据目录同时只能由一个Model打开，添加了测试数据时直接交给界面使用
+    app = WeatherSysGUI(db)
     app.mainloop()
@@ -0,0 +1,2206 @@
+"""
+气象数据管理系统的数据模型：四张表的存储后端、索引、预汇总表，以及基于pandas的Model与基于sqlite3的SqliteModel
+不依赖tkinter、matplotlib等界面相关的库，图形界面（main.py）与无界面的导入工具（ingest.py）都从这里导入
+"""
+import os
+import io
+import json
+import time
+import shutil
+import threading
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+import sqlite3
+import pandas as pd
+import numpy as np
+# 数据目录的排他锁，Windows上没有fcntl，改用msvcrt
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+# 获取当前工作目录
+current_path = os.getcwd()
+# 数据文件所在目录
+data_dir = os.path.join(current_path, "data")
+# 表名与数据文件名的对应关系
+table_files = {"station": "测量站表", "place": "地点表", "sensor": "传感器表", "record": "测量记录表"}
+# 各表的字段及其存储类型
+table_fields = {
+    "station": {"id": "int", "测量站名称": "str", "代表地区": "str", "测量站状态": "str"},
+    "place": {"id": "int", "地点编号": "str", "经度": "float", "纬度": "float", "海拔": "float", "地点状态": "str", "测量站ID": "int"},
+    "sensor": {"id": "int", "传感器类型": "str", "测量值单位": "str", "传感器编号": "str", "上线时间": "str", "下线时间": "str", "传感器状态": "str", "地点ID": "int"},
+    "record": {"id": "int", "时间": "datetime", "测量值": "float", "传感器ID": "int"},
+}
+# 各表在内存中的数据类型，取值重复度高的字符串字段使用category
+table_dtypes = {
+    "station": {"id": "int32", "测量站名称": "object", "代表地区": "category", "测量站状态": "category"},
+    "place": {"id": "int32", "地点编号": "object", "经度": "float64", "纬度": "float64", "海拔": "float64", "地点状态": "category", "测量站ID": "int32"},
+    "sensor": {"id": "int32", "传感器类型": "category", "测量值单位": "category", "传感器编号": "object", "上线时间": "object", "下线时间": "object", "传感器状态": "category", "地点ID": "int32"},
+    "record": {"id": "int64", "时间": "datetime64[s]", "测量值": "float64", "传感器ID": "int32"},
+}
+
+def atomic_write(path : str, write):
+    """调用write(f)把内容写到临时文件并刷到磁盘，再重命名覆盖path，中途崩溃时path仍是完整的旧内容"""
+    temp = path + ".tmp"
+    with open(temp, 'w', encoding="utf-8", newline="") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+class CsvStorage():
+    """CSV存储后端，每张表保存为data目录下的一个csv文件"""
+    # 时间统一写成完整格式，避免整点日期被简写成只有日期而与已有行格式不一致
+    date_format = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self, data_dir : str = data_dir) -> None:
+        self.data_dir = data_dir
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+
+    def path(self, table_name : str) -> str:
+        """获取表文件路径"""
+        return os.path.join(self.data_dir, table_files[table_name] + ".csv")
+
+    def exists(self, table_name : str) -> bool:
+        """判断表文件是否存在"""
+        return os.path.exists(self.path(table_name))
+
+    def write_header(self, table_name : str):
+        """写入只有表头的空表"""
+        with open(self.path(table_name), 'w', encoding="utf-8") as f:
+            f.write(",".join(table_fields[table_name]) + "\n")
+
+    def load(self, table_name : str) -> pd.DataFrame:
+        """读取表"""
+        path = self.path(table_name)
+        # 检查数据文件是否存在，如果不存在则创建
+        if not os.path.exists(path):
+            self.write_header(table_name)
+        # 尝试读取数据文件，如果文件为空则写入表头；
+        # 如果文件格式错误，先把原文件备份为.corrupt文件，再跳过无法解析的行读取其余数据
+        try:
+            return pd.read_csv(path)
+        except pd.errors.EmptyDataError:
+            self.write_header(table_name)
+        except pd.errors.ParserError as e:
+            backup = path + ".corrupt"
+            shutil.copyfile(path, backup)
+            warnings.warn(f"{path}格式错误，已备份到{backup}，跳过无法解析的行：{e}")
+            return pd.read_csv(path, on_bad_lines="skip")
+        return pd.read_csv(path)
+
+    def save(self, table_name : str, df : pd.DataFrame):
+        """全量重写表，先写临时文件再重命名，写到一半崩溃不会损坏原文件"""
+        atomic_write(self.path(table_name), lambda f: df.to_csv(f, index=False, date_format=self.date_format))
+
+    def append(self, table_name : str, df : pd.DataFrame):
+        """将新行追加到表文件末尾"""
+        df.to_csv(self.path(table_name), mode="a", header=False, index=False, date_format=self.date_format)
+
+class NpyStorage():
+    """
+    NumPy二进制列式存储后端，每张表是一个目录，每个字段按类型存成一个.npy文件
+    时间字段存为datetime64[s]，数值字段存为float64/int64，读取时使用内存映射，无需解析文本
+    追加的新行写成独立的分段目录，读取时拼接，save会把所有分段合并为一个以-full结尾的完整分段，
+    读取时忽略最后一个完整分段之前的分段，旧分段删除之前崩溃也不会重复读取
+    """
+
+    def __init__(self, data_dir : str = data_dir) -> None:
+        self.data_dir = data_dir
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+
+    def path(self, table_name : str) -> str:
+        """获取表目录路径"""
+        return os.path.join(self.data_dir, table_files[table_name])
+
+    def exists(self, table_name : str) -> bool:
+        """判断表目录是否存在"""
+        return os.path.isdir(self.path(table_name))
+
+    def parts(self, table_name : str) -> list:
+        """按写入顺序列出表的所有分段目录"""
+        path = self.path(table_name)
+        if not os.path.isdir(path):
+            return []
+        parts = [name for name in sorted(os.listdir(path)) if name.startswith("part-") and not name.endswith(".tmp")]
+        full = [i for i, name in enumerate(parts) if name.endswith("-full")]
+        return [os.path.join(path, name) for name in parts[full[-1] if full else 0:]]
+
+    def next_part(self, table_name : str) -> str:
+        """获取下一个分段的编号，已有分段目录名形如part-00000001或part-00000001-full"""
+        parts = self.parts(table_name)
+        return "%08d" % (int(os.path.basename(parts[-1])[5:13]) + 1 if parts else 0)
+
+    def load_part(self, table_name : str, part : str) -> pd.DataFrame:
+        """读取一个分段"""
+        columns = {}
+        for field, kind in table_fields[table_name].items():
+            values = np.load(os.path.join(part, field + ".npy"), mmap_mode="r")
+            if kind == "str":
+                # 定长字符串转回Python字符串，空串还原为缺失值
+                values = pd.Series(values.astype(object)).replace("", np.nan)
+            columns[field] = values
+        return pd.DataFrame(columns)
+
+    def load(self, table_name : str) -> pd.DataFrame:
+        """读取表"""
+        parts = [self.load_part(table_name, part) for part in self.parts(table_name)]
+        if not parts:
+            return pd.DataFrame(columns=list(table_fields[table_name]))
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+    def write_part(self, table_name : str, df : pd.DataFrame, part : str):
+        """把df按字段类型写成一个分段，先写临时目录再重命名"""
+        temp = part + ".tmp"
+        os.makedirs(temp, exist_ok=True)
+        for field, kind in table_fields[table_name].items():
+            column = df[field] if field in df.columns else pd.Series([np.nan] * len(df))
+            if kind == "int":
+                values = pd.to_numeric(column).to_numpy(dtype="int64")
+            elif kind == "float":
+                values = pd.to_numeric(column).to_numpy(dtype="float64")
+            elif kind == "datetime":
+                values = pd.to_datetime(column).to_numpy(dtype="datetime64[s]")
+            else:
+                values = column.astype(object).fillna("").astype(str).to_numpy(dtype=str)
+            np.save(os.path.join(temp, field + ".npy"), values)
+        os.replace(temp, part)
+
+    def save(self, table_name : str, df : pd.DataFrame):
+        """全量重写表，写成一个完整分段，之后再删除旧分段"""
+        path = self.path(table_name)
+        os.makedirs(path, exist_ok=True)
+        part = os.path.join(path, "part-%s-full" % self.next_part(table_name))
+        self.write_part(table_name, df, part)
+        for name in os.listdir(path):
+            if os.path.join(path, name) != part:
+                shutil.rmtree(os.path.join(path, name))
+
+    def append(self, table_name : str, df : pd.DataFrame):
+        """把新行写成一个新的分段"""
+        path = self.path(table_name)
+        os.makedirs(path, exist_ok=True)
+        self.write_part(table_name, df, os.path.join(path, "part-%s" % self.next_part(table_name)))
+
+class PartitionedStorage(CsvStorage):
+    """
+    按时间分区的CSV存储后端，测量记录表按时间拆分到data/测量记录表_分区/目录下，每个分区一个csv文件
+    freq为"M"时按月分区，为"D"时按天分区，其余三张表与CsvStorage相同
+    分区目录下的manifest.json记录各分区行数与最大id，插入新记录时无需读取全部分区
+    分区文件放在以代数命名的子目录（如gen-00000003）中，save把全部分区写入新的一代后再写清单切换过去，
+    最后删除旧的一代；中途崩溃时清单仍指向完整的旧一代，改到其他分区的记录不会同时出现在两个分区中
+    """
+    partition_formats = {"M": "%Y-%m", "D": "%Y-%m-%d"}
+
+    def __init__(self, data_dir : str = data_dir, freq : str = "M") -> None:
+        super().__init__(data_dir)
+        self.freq = freq
+        self.partition_format = self.partition_formats[freq]
+        self.partition_dir = os.path.join(data_dir, table_files["record"] + "_分区")
+        if not os.path.exists(self.partition_dir):
+            os.makedirs(self.partition_dir)
+        self.manifest_path = os.path.join(self.partition_dir, "manifest.json")
+        # 崩溃留下的未完成的一代等下次save时再删除，只读打开时不能删除写入方正在写的一代
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self) -> dict:
+        """读取分区清单，generation为当前的代数，为None时分区文件直接放在分区目录下（旧版本的布局）"""
+        if not os.path.exists(self.manifest_path):
+            return {"max_id": None, "rows": {}, "generation": None}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("generation", None)
+        return manifest
+
+    def generation_dir(self, generation : int = None) -> str:
+        """获取一代分区文件所在的目录"""
+        if generation is None:
+            return self.partition_dir
+        return os.path.join(self.partition_dir, "gen-%08d" % generation)
+
+    def remove_generations(self):
+        """删除当前一代以外的分区文件：save切换之后旧的一代，以及切换之前崩溃留下的未完成的一代"""
+        current = self.generation_dir(self.manifest["generation"])
+        for name in os.listdir(self.partition_dir):
+            path = os.path.join(self.partition_dir, name)
+            if name.startswith("gen-") and path != current:
+                shutil.rmtree(path)
+            elif name.endswith(".csv") and current != self.partition_dir:
+                os.remove(path)
+
+    def save_manifest(self):
+        """写入分区清单"""
+        atomic_write(self.manifest_path, lambda f: json.dump(self.manifest, f))
+
+    def partition_path(self, key : str) -> str:
+        """获取当前一代中分区文件的路径"""
+        return os.path.join(self.generation_dir(self.manifest["generation"]), key + ".csv")
+
+    def partitions(self) -> list:
+        """按时间顺序列出所有分区"""
+        return sorted(name[:-4] for name in os.listdir(self.generation_dir(self.manifest["generation"])) if name.endswith(".csv"))
+
+    def partition_keys(self, times) -> pd.Series:
+        """计算每个时间所属的分区"""
+        return pd.to_datetime(pd.Series(times)).dt.strftime(self.partition_format)
+
+    def partitions_between(self, start, end) -> list:
+        """列出与时间范围[start, end]有重叠的分区，空字符串表示不限"""
+        keys = self.partitions()
+        if start != "":
+            first = pd.Timestamp(start).strftime(self.partition_format)
+            keys = [key for key in keys if key >= first]
+        if end != "":
+            last = pd.Timestamp(end).strftime(self.partition_format)
+            keys = [key for key in keys if key <= last]
+        return keys
+
+    def next_id(self, table_name : str):
+        """从分区清单中获取下一个可用的id，没有记录时返回0"""
+        max_id = self.manifest["max_id"]
+        return 0 if max_id is None else max_id + 1
+
+    def load_partition(self, key : str) -> pd.DataFrame:
+        """读取一个分区"""
+        return pd.read_csv(self.partition_path(key))
+
+    def load(self, table_name : str) -> pd.DataFrame:
+        """读取表，测量记录表会读取全部分区"""
+        if table_name != "record":
+            return super().load(table_name)
+        parts = [self.load_partition(key) for key in self.partitions()]
+        if not parts:
+            return pd.DataFrame(columns=list(table_fields[table_name]))
+        return pd.concat(parts, ignore_index=True)
+
+    def save(self, table_name : str, df : pd.DataFrame):
+        """全量重写表，测量记录表的全部分区写入新的一代，写完后原子地替换清单切换过去，再删除旧的一代"""
+        if table_name != "record":
+            return super().save(table_name, df)
+        generation = (self.manifest["generation"] or 0) + 1
+        path = self.generation_dir(generation)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        rows = {}
+        for key, part in df.groupby(self.partition_keys(df["时间"]).to_numpy()):
+            atomic_write(os.path.join(path, key + ".csv"), lambda f: part.to_csv(f, index=False, date_format=self.date_format))
+            rows[key] = len(part)
+        self.manifest = {"max_id": int(df["id"].max()) if len(df) else None, "rows": rows, "generation": generation}
+        self.save_manifest()
+        self.remove_generations()
+
+    def append(self, table_name : str, df : pd.DataFrame):
+        """将新行追加到各自所属分区的末尾"""
+        if table_name != "record":
+            return super().append(table_name, df)
+        for key, part in df.groupby(self.partition_keys(df["时间"]).to_numpy()):
+            path = self.partition_path(key)
+            part.to_csv(path, mode="a", header=not os.path.exists(path), index=False, date_format=self.date_format)
+            self.manifest["rows"][key] = self.manifest["rows"].get(key, 0) + len(part)
+        max_id = int(df["id"].max())
+        if self.manifest["max_id"] is None or max_id > self.manifest["max_id"]:
+            self.manifest["max_id"] = max_id
+        self.save_manifest()
+
+def migrate_storage(source, target):
+    """把source存储后端中的四张表一次性迁移到target存储后端"""
+    for table_name in table_files:
+        target.save(table_name, source.load(table_name))
+
+# 预写日志文件名，与四张表并列保存在数据目录中
+wal_file = "预写日志.jsonl"
+# 数据目录锁文件名
+lock_file = "数据目录.lock"
+
+class DataDirLock():
+    """
+    数据目录的排他锁：每个Model在内存中保存各表的副本并在检查点时整体重写表文件，
+    同一数据目录同时只能由一个Model读写，否则一方的改动会被另一方覆盖
+    """
+
+    def __init__(self, path : str) -> None:
+        self.path = path
+        self.file = None
+
+    def acquire(self) -> bool:
+        """不等待地加锁，已被其他Model（包括同一进程中的）持有时返回False"""
+        self.file = open(self.path, "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self.file.close()
+            self.file = None
+            return False
+        return True
+
+    def release(self):
+        """释放锁，关闭锁文件时操作系统会解锁"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class WriteAheadLog():
+    """
+    预写日志：每次改动追加一行JSON，表文件只在检查点时整体重写
+    日志每次追加都写入操作系统，每攒够group_size条或距上次刷盘超过group_interval秒时才fsync一次（组提交），
+    没有后续改动时由定时器在第一条未刷盘的改动之后group_interval秒内fsync，
+    进程崩溃不会丢失已追加的改动，断电最多丢失最近group_interval秒内的改动
+    """
+
+    def __init__(self, path : str, group_size : int = 32, group_interval : float = 0.2) -> None:
+        self.path = path
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.file = open(path, "ab")
+        self.unsynced = 0 # 尚未fsync的条数
+        self.synced_at = time.monotonic()
+        self.timer = None # 到期刷盘的定时器，没有未刷盘的改动时为None
+        # 定时器在另一个线程中刷盘，与追加、清空互斥
+        self.lock = threading.RLock()
+
+    def size(self) -> int:
+        """日志文件的字节数"""
+        return self.file.tell()
+
+    def append(self, entry : dict):
+        """追加一条改动，按组提交的条件决定是否fsync，不立即fsync时确保有定时器按期刷盘"""
+        line = json.dumps(entry, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.group_size or time.monotonic() - self.synced_at >= self.group_interval:
+                self.sync()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.group_interval, self.sync)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def sync(self):
+        """把已追加的改动刷到磁盘，取消等待中的定时器"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.unsynced and not self.file.closed:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+            self.synced_at = time.monotonic()
+
+    @staticmethod
+    def read(path : str) -> tuple:
+        """按顺序读出日志文件中的全部改动，在末尾写到一半的行（崩溃或正在写入时留下）处停止，返回(改动列表, 完整行的字节数)"""
+        entries = []
+        valid = 0
+        if not os.path.exists(path):
+            return entries, valid
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                # 一个事务的改动写在同一行，要么全部重放，要么全部丢弃
+                entries.extend(entry["entries"] if entry["op"] == "transaction" else [entry])
+                valid += len(line)
+        return entries, valid
+
+    def entries(self) -> list:
+        """按顺序读出日志中的全部改动，末尾写到一半的行（崩溃时留下）及其之后的内容被截掉"""
+        entries, valid = self.read(self.path)
+        with self.lock:
+            if valid < self.size():
+                self.file.truncate(valid)
+                self.file.seek(valid)
+        return entries
+
+    def reset(self):
+        """检查点完成后清空日志"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.file.truncate(0)
+            self.file.seek(0)
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+            self.synced_at = time.monotonic()
+
+    def close(self):
+        """刷盘并关闭日志文件"""
+        with self.lock:
+            self.sync()
+            self.file.close()
+
+# 测量记录的预汇总表：粒度 -> 文件名、时间桶长度
+rollup_files = {"hour": "测量记录表_小时汇总", "day": "测量记录表_每日汇总"}
+rollup_steps = {"hour": "1h", "day": "1D"}
+# 可以由预汇总表中的和、个数、最小值、最大值算出的统计量
+rollup_funcs = {"mean", "min", "max", "count", "sum"}
+
+def aggregate_records(rows : pd.DataFrame, freq : str, funcs : list) -> pd.DataFrame:
+    """按传感器分组、按时间以freq为间隔分桶，对测量值计算funcs中的统计量，只保留有数据的时间桶"""
+    columns = ["传感器ID", "时间"] + list(funcs)
+    if rows.empty:
+        return pd.DataFrame(columns=columns)
+    grouped = rows.groupby(["传感器ID", pd.Grouper(key="时间", freq=freq)], observed=True)["测量值"]
+    result = grouped.agg(list(dict.fromkeys(list(funcs) + ["count"]))).reset_index()
+    result = result[result["count"] > 0]
+    return result[columns].reset_index(drop=True)
+
+def summarize_records(rows : pd.DataFrame, step : str) -> pd.DataFrame:
+    """按传感器和长度为step的时间桶汇总测量值的和、个数、最小值、最大值，时间为时间桶的起点"""
+    keys = [rows["传感器ID"], rows["时间"].dt.floor(step)]
+    return rows["测量值"].astype("float64").groupby(keys).agg(["sum", "count", "min", "max"]).reset_index()
+
+def combine_summaries(parts : list) -> pd.DataFrame:
+    """合并多份汇总，同一传感器同一时间桶的行合并为一行"""
+    df = pd.concat(parts, ignore_index=True)
+    return df.groupby(["传感器ID", "时间"]).agg(sum=("sum", "sum"), count=("count", "sum"), min=("min", "min"), max=("max", "max")).reset_index()
+
+def aggregate_summaries(summary : pd.DataFrame, freq : str, funcs : list) -> pd.DataFrame:
+    """把汇总行按传感器分组、按时间以freq为间隔再次分桶，算出funcs中的统计量，结果与aggregate_records相同"""
+    columns = ["传感器ID", "时间"] + list(funcs)
+    if summary.empty:
+        return pd.DataFrame(columns=columns)
+    result = summary.groupby(["传感器ID", pd.Grouper(key="时间", freq=freq)]).agg(sum=("sum", "sum"), count=("count", "sum"), min=("min", "min"), max=("max", "max"))
+    result = result[result["count"] > 0]
+    result["mean"] = result["sum"] / result["count"]
+    return result.reset_index()[columns]
+
+def to_id_array(values) -> tuple:
+    """
+    把一组id转换为int64数组，返回(数组, 有效掩码)
+    与字典查找的语义一致：整数和值为整数的浮点数有效，字符串、None等其他值无效
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        return values.astype("int64", copy=False), np.ones(len(values), dtype=bool)
+    if values.dtype.kind == "f":
+        valid = np.isfinite(values) & (values == np.floor(values))
+        return np.where(valid, values, 0).astype("int64"), valid
+    keys, valid = [], []
+    for value in values.tolist():
+        if isinstance(value, (bool, np.bool_)):
+            ok = False
+        elif isinstance(value, (int, np.integer)):
+            ok = True
+        else:
+            ok = isinstance(value, (float, np.floating)) and float(value).is_integer()
+        keys.append(int(value) if ok else 0)
+        valid.append(ok)
+    return np.array(keys, dtype="int64"), np.array(valid, dtype=bool)
+
+class IdIndex():
+    """
+    主键索引：按id排好序的id数组及对应行号，用searchsorted二分查找
+    每行只占两个int64，比{id: 行号}字典小得多；新id通常大于已有id，追加时直接拼接，删除时用向量运算平移行号
+    """
+
+    def __init__(self, ids) -> None:
+        ids = np.asarray(ids, dtype="int64")
+        # 表中id通常按行号递增，已经有序时无需排序
+        if len(ids) > 1 and (np.diff(ids) < 0).any():
+            order = np.argsort(ids, kind="stable")
+            self.keys, self.rows = ids[order], order.astype("int64")
+        else:
+            self.keys, self.rows = ids.copy(), np.arange(len(ids), dtype="int64")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, id) -> bool:
+        return self.positions([id])[0] >= 0
+
+    def __getitem__(self, id) -> int:
+        row = self.positions([id])[0]
+        if row < 0:
+            raise KeyError(id)
+        return int(row)
+
+    def positions(self, ids) -> np.ndarray:
+        """批量查找id所在的行号，不存在的id返回-1"""
+        keys, valid = to_id_array(ids)
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype="int64")
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(valid & (self.keys[found] == keys), self.rows[found], -1)
+
+    def append(self, ids, start : int):
+        """把从行号start开始追加的新行加入索引"""
+        ids = np.asarray(ids, dtype="int64")
+        keys = np.concatenate([self.keys, ids])
+        rows = np.concatenate([self.rows, np.arange(start, start + len(ids), dtype="int64")])
+        # 只有新id不都大于已有id时才需要排序
+        if (np.diff(keys[max(len(self.keys) - 1, 0):]) < 0).any():
+            order = np.argsort(keys, kind="stable")
+            keys, rows = keys[order], rows[order]
+        self.keys, self.rows = keys, rows
+
+    def delete(self, removed : np.ndarray):
+        """removed为按行号的布尔掩码，去掉被删除的行，其余行号减去其前面被删除的行数"""
+        keep = ~removed[self.rows]
+        shift = np.cumsum(removed)
+        rows = self.rows[keep]
+        self.keys, self.rows = self.keys[keep], rows - shift[rows]
+
+class ForeignKeyIndex():
+    """
+    外键反向索引：按外键值排序的外键数组及对应的id数组，查找引用某些值的id时二分查找出各自的区间
+    新增的行先暂存，查询时再合并排序；删除与修改外键时用向量运算更新，不需要重建
+    """
+
+    def __init__(self, keys, ids) -> None:
+        keys = np.asarray(keys, dtype="int64")
+        order = np.argsort(keys, kind="stable")
+        self.keys, self.ids = keys[order], np.asarray(ids, dtype="int64")[order]
+        self.pending = [] # 尚未合并的[(外键数组, id数组)]
+
+    def merge(self):
+        """合并暂存的新行"""
+        if self.pending:
+            keys = np.concatenate([self.keys] + [part[0] for part in self.pending])
+            ids = np.concatenate([self.ids] + [part[1] for part in self.pending])
+            order = np.argsort(keys, kind="stable")
+            self.keys, self.ids = keys[order], ids[order]
+            self.pending = []
+
+    def bounds(self, keys) -> tuple:
+        """二分查找每个外键值在数组中的区间[lo, hi)"""
+        self.merge()
+        keys, valid = to_id_array(keys)
+        keys = np.unique(keys[valid])
+        return keys, np.searchsorted(self.keys, keys, side="left"), np.searchsorted(self.keys, keys, side="right")
+
+    def count(self, keys) -> int:
+        """统计引用这些外键值的行数"""
+        _, lo, hi = self.bounds(keys)
+        return int((hi - lo).sum())
+
+    def get(self, key) -> np.ndarray:
+        """引用外键值key的id，按id排序"""
+        return self.lookup([key])
+
+    def lookup(self, keys) -> np.ndarray:
+        """引用这些外键值中任意一个的id，去重后按id排序"""
+        _, lo, hi = self.bounds(keys)
+        if not len(lo):
+            return np.empty(0, dtype="int64")
+        return np.unique(np.concatenate([self.ids[start:end] for start, end in zip(lo, hi)]))
+
+    def groups(self, keys) -> dict:
+        """{外键值: 引用它的id列表}，只包含被引用的值，id按升序排列"""
+        keys, lo, hi = self.bounds(keys)
+        hit = hi > lo
+        return {key: np.sort(self.ids[start:end]).tolist() for key, start, end in zip(keys[hit].tolist(), lo[hit], hi[hit])}
+
+    def add(self, keys, ids):
+        """暂存新增的行"""
+        if len(ids):
+            self.pending.append((np.asarray(keys, dtype="int64"), np.asarray(ids, dtype="int64")))
+
+    def remove(self, ids):
+        """去掉这些id的行"""
+        self.merge()
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype="int64"))
+        self.keys, self.ids = self.keys[keep], self.ids[keep]
+
+    def move(self, ids, key):
+        """修改外键后，把这些id移到新的外键值下"""
+        self.remove(ids)
+        self.add(np.full(len(ids), key, dtype="int64"), ids)
+
+class RecordTimeIndex():
+    """
+    测量记录表按(传感器ID, 时间)排序的索引
+    每个传感器保存一段按时间排好序的时间数组及对应行号，范围查询用searchsorted二分查找，复杂度为O(log n + k)
+    新插入的记录先暂存，等到查询该传感器时再合并排序，只影响被插入的传感器；
+    删除记录时用向量运算平移行号，修改时间或传感器时只把被修改的行移出原来的传感器再暂存，都不需要重建
+    """
+
+    def __init__(self, df : pd.DataFrame) -> None:
+        self.blocks = {} # 传感器ID -> (时间数组, 行号数组)
+        self.pending = {} # 传感器ID -> 尚未合并的[(时间数组, 行号数组)]
+        sensors = df["传感器ID"].to_numpy()
+        times = self.to_int(df["时间"])
+        order = np.lexsort((times, sensors))
+        sorted_sensors = sensors[order]
+        bounds = np.flatnonzero(sorted_sensors[1:] != sorted_sensors[:-1]) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(order)]):
+            if start == end:
+                continue
+            positions = order[start:end]
+            self.blocks[sorted_sensors[start].item()] = (times[positions], positions)
+
+    @staticmethod
+    def to_int(times) -> np.ndarray:
+        """把时间转换为秒级整数，便于二分查找"""
+        return pd.to_datetime(pd.Series(times)).to_numpy(dtype="datetime64[s]").astype("int64")
+
+    @staticmethod
+    def to_bound(value, default : int) -> int:
+        """把查询条件中的时间转换为秒级整数，空字符串表示不限"""
+        if value == "":
+            return default
+        return int(pd.Timestamp(value).to_datetime64().astype("datetime64[s]").astype("int64"))
+
+    def append(self, new_rows : pd.DataFrame, start : int):
+        """记录从行号start开始追加的新行"""
+        self.add(new_rows["传感器ID"].to_numpy(), self.to_int(new_rows["时间"]), np.arange(start, start + len(new_rows)))
+
+    def add(self, sensors : np.ndarray, times : np.ndarray, positions : np.ndarray):
+        """按传感器暂存一批行"""
+        for sensor_id in np.unique(sensors):
+            mask = sensors == sensor_id
+            self.pending.setdefault(sensor_id.item(), []).append((times[mask], positions[mask]))
+
+    def remove(self, sensors : np.ndarray, positions : np.ndarray):
+        """把这些行号的行从它们原来所在的传感器sensors中去掉"""
+        for sensor_id in np.unique(sensors):
+            times, rows = self.block(sensor_id.item())
+            keep = ~np.isin(rows, positions)
+            self.blocks[sensor_id.item()] = (times[keep], rows[keep])
+
+    def delete(self, removed : np.ndarray):
+        """removed为按行号的布尔掩码，去掉被删除的行，其余行号减去其前面被删除的行数"""
+        shift = np.cumsum(removed)
+        def shifted(times, positions):
+            keep = ~removed[positions]
+            positions = positions[keep]
+            return times[keep], positions - shift[positions]
+        self.blocks = {sensor_id: shifted(*block) for sensor_id, block in self.blocks.items()}
+        self.pending = {sensor_id: [shifted(*part) for part in parts] for sensor_id, parts in self.pending.items()}
+
+    def block(self, sensor_id) -> tuple:
+        """获取一个传感器排好序的时间数组与行号数组，必要时先合并暂存的新行"""
+        if sensor_id in self.pending:
+            parts = self.pending.pop(sensor_id)
+            if sensor_id in self.blocks:
+                parts.insert(0, self.blocks[sensor_id])
+            times = np.concatenate([part[0] for part in parts])
+            positions = np.concatenate([part[1] for part in parts])
+            # 大部分情况下新记录的时间晚于已有记录，已经有序时无需排序
+            if len(times) > 1 and (np.diff(times) < 0).any():
+                order = np.argsort(times, kind="stable")
+                times, positions = times[order], positions[order]
+            self.blocks[sensor_id] = (times, positions)
+        return self.blocks.get(sensor_id, (np.empty(0, dtype="int64"), np.empty(0, dtype="int64")))
+
+    def sensors(self) -> list:
+        """列出所有传感器ID"""
+        return list(set(self.blocks) | set(self.pending))
+
+    def ranges(self, sensor_ids, start, end):
+        """逐个传感器二分查找[start, end]时间范围，生成(行号数组, 起点, 终点)"""
+        # NaT转换为整数后是最小值，不限起点时从它的下一个值开始，使缺失时间不会被匹配
+        left = self.to_bound(start, np.iinfo("int64").min + 1)
+        right = self.to_bound(end, np.iinfo("int64").max)
+        for sensor_id in sensor_ids:
+            times, positions = self.block(sensor_id)
+            yield positions, np.searchsorted(times, left, side="left"), np.searchsorted(times, right, side="right")
+
+    def count(self, sensor_ids, start, end) -> int:
+        """统计给定传感器在[start, end]时间范围内的记录数"""
+        return int(sum(hi - lo for _, lo, hi in self.ranges(sensor_ids, start, end)))
+
+    def lookup(self, sensor_ids, start, end) -> np.ndarray:
+        """查找给定传感器在[start, end]时间范围内的记录行号，按行号排序返回"""
+        result = [positions[lo:hi] for positions, lo, hi in self.ranges(sensor_ids, start, end)]
+        return np.sort(np.concatenate(result)) if result else np.empty(0, dtype="int64")
+
+class RecordRollup():
+    """
+    测量记录表按传感器和固定长度时间桶预先汇总的表，每行是一个传感器在一个时间桶内测量值的和、个数、最小值、最大值
+    插入记录时新行的汇总先暂存，查询时再与已有汇总合并；修改和删除记录时只重新计算受影响的时间桶
+    汇总表保存为与四张表并列的csv文件，追加写入的部分汇总在读取时合并
+    """
+
+    def __init__(self, step : str, path : str) -> None:
+        self.step = step
+        self.path = path
+        self.table = None # 汇总表，读取或建立之前为None
+        self.pending = [] # 尚未合并的新行汇总
+
+    def exists(self) -> bool:
+        """判断汇总表文件是否存在"""
+        return os.path.exists(self.path)
+
+    def build(self, record_df : pd.DataFrame):
+        """从整张测量记录表建立汇总表"""
+        self.table = summarize_records(record_df, self.step)
+        self.pending = []
+
+    def load(self):
+        """读取汇总表文件，合并其中追加写入的部分汇总"""
+        df = pd.read_csv(self.path)
+        df["时间"] = pd.to_datetime(df["时间"]).astype("datetime64[s]")
+        self.table = combine_summaries([df])
+        self.pending = []
+
+    def save(self):
+        """全量重写汇总表文件，先写临时文件再重命名"""
+        self.merge()
+        atomic_write(self.path, lambda f: self.table.to_csv(f, index=False, date_format=CsvStorage.date_format))
+
+    def append(self, new_rows : pd.DataFrame):
+        """把新行的汇总追加到汇总表文件末尾，文件不存在时以后会从测量记录表完整建立"""
+        if self.exists():
+            summarize_records(new_rows, self.step).to_csv(self.path, mode="a", header=False, index=False, date_format=CsvStorage.date_format)
+
+    def add(self, new_rows : pd.DataFrame):
+        """暂存新插入记录的汇总"""
+        if self.table is not None:
+            self.pending.append(summarize_records(new_rows, self.step))
+
+    def merge(self):
+        """把暂存的汇总合并进汇总表"""
+        if self.pending:
+            self.table = combine_summaries([self.table] + self.pending)
+            self.pending = []
+
+    def refresh(self, record_df : pd.DataFrame, keys : pd.DataFrame):
+        """根据record_df重新计算keys中各记录(传感器ID, 时间)所在的时间桶"""
+        self.merge()
+        affected = pd.MultiIndex.from_arrays([keys["传感器ID"].to_numpy(), keys["时间"].dt.floor(self.step).to_numpy()]).unique()
+        rows = record_df[record_df["传感器ID"].isin(affected.get_level_values(0))]
+        rows = rows[pd.MultiIndex.from_arrays([rows["传感器ID"].to_numpy(), rows["时间"].dt.floor(self.step).to_numpy()]).isin(affected)]
+        stale = pd.MultiIndex.from_arrays([self.table["传感器ID"].to_numpy(), self.table["时间"].to_numpy()]).isin(affected)
+        self.table = pd.concat([self.table[~stale], summarize_records(rows, self.step)], ignore_index=True)
+
+    def select(self, sensor_ids, start, end) -> pd.DataFrame:
+        """取出给定传感器时间桶起点在[start, end)内的汇总行，sensor_ids、start、end为None表示不限"""
+        self.merge()
+        table = self.table
+        mask = np.ones(len(table), dtype=bool)
+        if sensor_ids is not None:
+            mask &= table["传感器ID"].isin(sensor_ids).to_numpy()
+        if start is not None:
+            mask &= (table["时间"] >= start).to_numpy()
+        if end is not None:
+            mask &= (table["时间"] < end).to_numpy()
+        return table[mask]
+
+class Model():
+    """
+    这个类用来存储、管理数据，为前端提供数据接口
+    """
+
+    def __init__(self, append_only : bool = True, storage = None, value_dtype : str = "float64", lazy_record : bool = False, cache_size : int = 8,
+                 wal : bool = True, checkpoint_size : int = 16 * 1024 * 1024, read_only : bool = False) -> None:
+        """
+        初始化数据模型，append_only为True时插入只追加新行，修改和删除只重写被改动的表
+        storage为存储后端，默认使用CsvStorage
+        value_dtype为测量值在内存中的类型，可设为"float32"以减半测量值占用的内存
+        lazy_record为True时启动不读取测量记录表，按时间范围查询只读取相关分区（需要PartitionedStorage），
+        最多缓存cache_size个分区；其余需要整张测量记录表的操作会在第一次使用时读取全部分区
+        wal为True时每次改动只在预写日志末尾追加一行（此时不再使用append_only），日志超过checkpoint_size字节时
+        做一次检查点，把有改动的表原子地重写到表文件；启动时重放上次检查点之后的日志
+        read_only为True时以只读方式打开：不锁数据目录、不写任何文件，可以在导入服务运行时查询，
+        读取时重放日志但不做检查点，调用reload重新读取导入服务之后写入的数据，增删改引发ReadOnlyError
+        """
+        self.read_only = read_only
+        self.append_only = append_only
+        self.storage = storage if storage is not None else CsvStorage()
+        self.value_dtype = value_dtype
+        self.lazy_record = lazy_record
+        if lazy_record and not isinstance(self.storage, PartitionedStorage):
+            raise ValueError("lazy_record需要使用PartitionedStorage存储后端")
+        self.cache_size = cache_size
+        self.record_cache = OrderedDict() # 已读取的分区：分区名 -> df，按最近使用排序
+        self.record_index = None # 测量记录表按(传感器ID, 时间)排序的索引，第一次按时间范围查询时建立
+        self.column_stats = {} # 查询计划使用的字段统计信息：(表名, 字段) -> 统计信息
+        self.union_views = {} # 联表查询视图：表名 -> 每行在各上层表中的行号（列名为上层表名），第一次联表查询时建立
+        self.view_counters = {"build": 0, "patch": 0, "invalidate": 0} # 联表视图的建立、增量修补、失效次数
+        self.station_df = None
+        self.place_df = None
+        self.sensor_df = None
+        self.record_df = None
+        self.eng2chs = {"station": "测量站", "place": "地点", "sensor": "传感器", "record": "测量记录"}
+        self.order = ["station", "place", "sensor", "record"] # 层级表
+        self.name_list = ["测量站", "地点", "传感器", "测量记录"] # 名称表
+        self.id_index = {} # 主键索引：表名 -> IdIndex
+        self.fk_index = {} # 外键反向索引：表名 -> ForeignKeyIndex
+        self.wal_path = os.path.join(self.storage.data_dir, wal_file)
+        if read_only:
+            # 只读方式不锁数据目录，也不打开预写日志（打开会截断正在写入的末尾）
+            self.lock = None
+            self.wal = None
+        else:
+            # 锁住数据目录，防止导入服务与界面等多个Model同时写入
+            self.lock = DataDirLock(os.path.join(self.storage.data_dir, lock_file))
+            if not self.lock.acquire():
+                raise self.DataDirLockedError(self.storage.data_dir)
+            self.wal = WriteAheadLog(self.wal_path) if wal else None
+        self.checkpoint_size = checkpoint_size
+        self.dirty = set() # 改动只记在预写日志中、尚未写入表文件的表
+        self.changes = None # 事务中尚未持久化的改动，不在事务中时为None
+        self.undo = None # 事务中原地修改前的旧值与类型，回滚时按相反顺序写回
+        self.load_df()
+
+    def load_df(self):
+        """重载数据，读取表文件后重放预写日志中上次检查点之后的改动"""
+        for table_name in self.order:
+            # 懒加载模式下测量记录表等到用到时再读取
+            if table_name == "record" and self.lazy_record:
+                self.record_df = None
+                self.record_cache.clear()
+                continue
+            setattr(self, table_name + "_df", self.apply_schema(table_name, self.storage.load(table_name)))
+        # 预汇总表在第一次汇总查询时读取，文件不存在时从测量记录表建立
+        self.rollups = {name: RecordRollup(step, os.path.join(self.storage.data_dir, rollup_files[name] + ".csv")) for name, step in rollup_steps.items()}
+        if self.read_only:
+            # 只读方式重放写入方日志中已写完的行，不截断、不做检查点
+            entries = WriteAheadLog.read(self.wal_path)[0]
+        else:
+            entries = self.wal.entries() if self.wal is not None else []
+        if entries:
+            self.replay(entries)
+        self.build_index()
+        self.invalidate_views()
+        if entries and not self.read_only:
+            # 把恢复的改动写入表文件，清空日志
+            self.checkpoint()
+
+    def reload(self, retries : int = 3):
+        """
+        只读方式下重新读取数据目录，看到写入方（如导入服务）之后写入的改动
+        写入方恰好在做检查点时文件可能被替换或删除，稍后重试
+        """
+        for attempt in range(retries):
+            try:
+                if isinstance(self.storage, PartitionedStorage):
+                    self.storage.manifest = self.storage.load_manifest()
+                self.column_stats.clear()
+                self.load_df()
+                return
+            except (FileNotFoundError, pd.errors.EmptyDataError):
+                if attempt == retries - 1:
+                    raise
+                time.sleep(0.1)
+
+    def replay(self, entries : list):
+        """
+        按顺序重放预写日志中的改动，插入按id覆盖、修改按id赋值、删除按id删除，
+        检查点写到一半崩溃时部分表文件已包含这些改动，再次重放结果不变
+        """
+        for entry in entries:
+            table_name = entry["table"]
+            df = self.get_df(table_name)
+            if entry["op"] == "insert":
+                rows = self.conform(table_name, pd.read_csv(io.StringIO(entry["rows"])))
+                df = pd.concat([df[~df["id"].isin(rows["id"])], rows], ignore_index=True)
+            elif entry["op"] == "update":
+                values = self.conform(table_name, pd.DataFrame([entry["values"]]))
+                df.loc[df["id"].isin(entry["ids"]), list(entry["values"])] = values.iloc[0].tolist()
+            else:
+                df = df[~df["id"].isin(entry["ids"])].reset_index(drop=True)
+            setattr(self, table_name + "_df", df)
+            self.dirty.add(table_name)
+        if "record" in self.dirty:
+            self.record_index = None
+            # 预汇总表文件可能已追加了部分重放的插入，按恢复后的测量记录表重新建立
+            for rollup in self.rollups.values():
+                if rollup.exists():
+                    rollup.build(self.record_df)
+
+    def get_df(self, table_name : str, time_range = None) -> pd.DataFrame:
+        """
+        获取表的df视图，懒加载模式下测量记录表尚未读取时：
+        给出时间范围则只返回相关分区拼接成的df，否则读取全部分区
+        """
+        df = getattr(self, table_name + "_df")
+        if df is not None:
+            return df
+        if time_range is not None:
+            start, end = time_range if isinstance(time_range, tuple) else (time_range, time_range)
+            parts = [self.load_partition(key) for key in self.storage.partitions_between(start, end)]
+            if not parts:
+                return self.apply_schema(table_name, pd.DataFrame(columns=list(table_fields[table_name])))
+            return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+        self.record_df = self.apply_schema(table_name, self.storage.load(table_name))
+        self.record_cache.clear()
+        self.build_index(table_name)
+        return self.record_df
+
+    def load_partition(self, key : str) -> pd.DataFrame:
+        """读取测量记录表的一个分区，使用LRU缓存"""
+        if key in self.record_cache:
+            self.record_cache.move_to_end(key)
+            return self.record_cache[key]
+        df = self.apply_schema("record", self.storage.load_partition(key))
+        self.record_cache[key] = df
+        if len(self.record_cache) > self.cache_size:
+            self.record_cache.popitem(last=False)
+        return df
+
+    def recent_range(self):
+        """懒加载模式下返回最近一个分区的时间范围，供界面默认只显示最近的记录，否则返回None"""
+        if not self.lazy_record or self.record_df is not None:
+            return None
+        partitions = self.storage.partitions()
+        return (partitions[-1], "") if partitions else None
+    
+    def save_df(self, table_name : str = None):
+        """保存数据，不指定table_name时重写全部四张表"""
+        table_names = self.order if table_name is None else [table_name]
+        for name in table_names:
+            df = getattr(self, name + "_df")
+            # 懒加载模式下尚未读取的测量记录表没有改动，无需保存
+            if df is not None:
+                self.storage.save(name, df)
+
+    def append_df(self, table_name : str, df : pd.DataFrame):
+        """将新增的行追加到表文件末尾，不重写已有内容"""
+        self.storage.append(table_name, df.reindex(columns=self.get_fields(table_name)))
+
+    def persist(self, table_name : str, new_rows : pd.DataFrame = None, ids : list = None, values : dict = None):
+        """
+        持久化一次改动，new_rows不为空表示本次改动只是追加了这些行，
+        否则values不为空表示把ids这些行的字段改为values，都为空表示删除了ids这些行
+        在事务中时先暂存，事务结束时一起持久化
+        """
+        change = (table_name, new_rows, ids, values)
+        if self.changes is not None:
+            self.changes.append(change)
+        else:
+            self.flush([change])
+
+    def flush(self, changes : list):
+        """
+        把一组改动持久化：启用预写日志时写成日志中的一行，表文件在检查点时再重写；
+        否则每张改动过的表只追加新行或重写一次
+        """
+        if self.wal is not None:
+            entries = [self.wal_entry(*change) for change in changes]
+            self.wal.append(entries[0] if len(entries) == 1 else {"op": "transaction", "entries": entries})
+            self.dirty.update(change[0] for change in changes)
+            new_records = [new_rows for table_name, new_rows, ids, values in changes if table_name == "record" and new_rows is not None]
+            if new_records:
+                # 汇总表文件仍按新行追加，修改和删除后的汇总表在检查点时重写
+                self.persist_rollups(pd.concat(new_records, ignore_index=True))
+            if self.wal.size() >= self.checkpoint_size:
+                self.checkpoint()
+            return
+        if not self.append_only:
+            self.save_df()
+        for table_name in dict.fromkeys(change[0] for change in changes):
+            new_rows = [change[1] for change in changes if change[0] == table_name]
+            # 只有插入时追加新行，否则重写整张表
+            new_rows = pd.concat(new_rows, ignore_index=True) if all(rows is not None for rows in new_rows) else None
+            if self.append_only:
+                if new_rows is not None:
+                    self.append_df(table_name, new_rows)
+                else:
+                    self.save_df(table_name)
+            if table_name == "record":
+                self.persist_rollups(new_rows)
+
+    def wal_entry(self, table_name : str, new_rows : pd.DataFrame = None, ids : list = None, values : dict = None) -> dict:
+        """把一次改动转换为预写日志中的一条记录"""
+        if new_rows is not None:
+            # 新行写成csv文本，比逐个字段转换为JSON快得多
+            return {"op": "insert", "table": table_name, "rows": new_rows.to_csv(index=False, date_format=CsvStorage.date_format)}
+        entry = {"op": "update" if values is not None else "delete", "table": table_name, "ids": [int(id) for id in ids]}
+        if values is not None:
+            entry["values"] = values
+        return entry
+
+    @contextmanager
+    def transaction(self):
+        """
+        事务：with model.transaction(): 中的任意多次改动在结束时一起持久化一次，
+        其中引发异常时撤销全部改动，恢复到事务开始前的状态后再引发异常；嵌套的事务并入外层事务
+        """
+        if self.changes is not None:
+            yield self
+            return
+        # 插入和删除会生成新的df，只需保存各表的引用；修改是原地改动，由update把旧值记入撤销日志
+        snapshot = {table_name: getattr(self, table_name + "_df") for table_name in self.order}
+        rollups = {name: (rollup.table, list(rollup.pending)) for name, rollup in self.rollups.items()}
+        self.changes = []
+        self.undo = []
+        try:
+            yield self
+        except BaseException:
+            self.changes = None
+            self.rollback(snapshot, rollups)
+            raise
+        finally:
+            self.undo = None
+        changes, self.changes = self.changes, None
+        if changes:
+            self.flush(changes)
+
+    def rollback(self, snapshot : dict, rollups : dict):
+        """撤销事务中的改动：按相反顺序写回被修改的旧值，恢复事务开始前的各表与预汇总表，重建索引，联表视图失效"""
+        for df, rows, field, old_values, dtype in reversed(self.undo):
+            if rows is not None:
+                df.loc[rows, field] = old_values
+            # 写入新值时列的类型可能已经改变（如category增加了类别、整数变为浮点数），恢复原来的类型
+            if df[field].dtype != dtype:
+                df[field] = df[field].astype(dtype)
+        for table_name, df in snapshot.items():
+            setattr(self, table_name + "_df", df)
+        for name, (table, pending) in rollups.items():
+            self.rollups[name].table = table
+            self.rollups[name].pending = pending
+        self.build_index()
+        self.invalidate_views()
+
+    def persist_rollups(self, new_rows : pd.DataFrame = None):
+        """持久化预汇总表，new_rows不为空时只追加新行的汇总，否则重写已读取的汇总表"""
+        for rollup in self.rollups.values():
+            if new_rows is not None:
+                rollup.append(new_rows)
+            elif rollup.table is not None:
+                rollup.save()
+
+    def checkpoint(self):
+        """检查点：把有改动的表与已读取的预汇总表原子地重写到文件，然后清空预写日志"""
+        if self.wal is None:
+            return
+        for table_name in self.order:
+            if table_name in self.dirty:
+                self.save_df(table_name)
+        self.persist_rollups()
+        self.wal.reset()
+        self.dirty.clear()
+
+    def compact(self):
+        """压缩数据文件：全量重写四张表与已读取的预汇总表，并清空预写日志"""
+        self.check_writable()
+        self.save_df()
+        self.persist_rollups()
+        if self.wal is not None:
+            self.wal.reset()
+            self.dirty.clear()
+
+    def close(self):
+        """关闭数据模型：做一次检查点并关闭预写日志，然后释放数据目录锁（只读方式下什么都不写）"""
+        if self.wal is not None:
+            self.checkpoint()
+            self.wal.close()
+        if self.lock is not None:
+            self.lock.release()
+
+    def check_writable(self):
+        """只读方式下拒绝增删改"""
+        if self.read_only:
+            raise self.ReadOnlyError(self.storage.data_dir)
+
+    def get_dtypes(self, table_name : str) -> dict:
+        """获取表在内存中的字段类型"""
+        dtypes = dict(table_dtypes[table_name])
+        if table_name == "record":
+            dtypes["测量值"] = self.value_dtype
+        return dtypes
+
+    def apply_schema(self, table_name : str, df : pd.DataFrame) -> pd.DataFrame:
+        """把df的各字段转换为表在内存中的类型"""
+        for column, dtype in self.get_dtypes(table_name).items():
+            if column not in df.columns:
+                continue
+            if dtype.startswith("datetime64"):
+                df[column] = pd.to_datetime(df[column]).astype(dtype)
+            elif dtype.startswith("int") and df[column].isna().any():
+                # 含缺失值的整数字段无法转换为整数类型，保留为浮点数
+                df[column] = pd.to_numeric(df[column])
+            else:
+                df[column] = df[column].astype(dtype)
+        return df
+
+    def conform(self, table_name : str, new_rows : pd.DataFrame) -> pd.DataFrame:
+        """把新行转换成与表中已有数据一致的类型，category字段补齐新出现的取值，使拼接后类型不变"""
+        df = getattr(self, table_name + "_df")
+        new_rows = self.apply_schema(table_name, new_rows)
+        if df is None:
+            return new_rows
+        for column in new_rows.columns:
+            if column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype):
+                missing = new_rows[column].cat.categories.difference(df[column].cat.categories)
+                if len(missing):
+                    if self.undo is not None:
+                        # 回滚时去掉补齐的类别
+                        self.undo.append((df, None, column, None, df[column].dtype))
+                    df[column] = df[column].cat.add_categories(missing)
+                new_rows[column] = new_rows[column].cat.set_categories(df[column].cat.categories)
+        return new_rows
+
+    def memory_usage(self) -> dict:
+        """统计每张表在内存中占用的字节数"""
+        usage = {}
+        for table_name in self.order:
+            df = getattr(self, table_name + "_df")
+            usage[table_name] = int(df.memory_usage(deep=True).sum()) if df is not None else 0
+        # 懒加载模式下加上已缓存分区占用的内存
+        usage["record"] += sum(int(part.memory_usage(deep=True).sum()) for part in self.record_cache.values())
+        return usage
+
+    def build_index(self, table_name : str = None):
+        """重建主键索引与外键反向索引，不指定table_name时重建全部四张表"""
+        table_names = self.order if table_name is None else [table_name]
+        for name in table_names:
+            df = getattr(self, name + "_df")
+            if df is None:
+                continue
+            if name == "record":
+                # 行号发生变化，时间排序索引失效，下次查询时重建
+                self.record_index = None
+            self.id_index[name] = IdIndex(df["id"].to_numpy())
+            if name == "station":
+                continue
+            column = self.get_foreign_field(name)
+            self.fk_index[name] = ForeignKeyIndex(df[column].to_numpy(), df["id"].to_numpy())
+
+    def add_index(self, table_name : str, new_rows : pd.DataFrame, start : int):
+        """把从行号start开始追加的新行加入索引"""
+        self.id_index[table_name].append(new_rows["id"].to_numpy(), start)
+        if table_name == "record" and self.record_index is not None:
+            self.record_index.append(new_rows, start)
+        if table_name == "station":
+            return
+        column = self.get_foreign_field(table_name)
+        self.fk_index[table_name].add(new_rows[column].to_numpy(), new_rows["id"].to_numpy())
+
+    def remove_index(self, table_name : str, removed : np.ndarray, ids : list):
+        """删除行后更新索引，removed为按删除前行号的布尔掩码"""
+        if table_name == "record" and self.record_index is not None:
+            self.record_index.delete(removed)
+        self.id_index[table_name].delete(removed)
+        if table_name != "station":
+            self.fk_index[table_name].remove(ids)
+
+    def get_foreign_field(self, table_name : str) -> str:
+        """获取表中外键字段名，station表没有外键，返回None"""
+        index = self.order.index(table_name)
+        return self.name_list[index - 1] + "ID" if index > 0 else None
+
+    # 定义一个类内异常类：删除违反参照完整性
+    class DelReferentialIntegrityError(Exception):
+        """违反参照完整性"""
+        def __init__(self, table_name : str, id : int, ref_table_name : str, ids : list, refs : dict = None) -> None:
+            self.table_name = table_name
+            self.id = id
+            self.ref_table_name = ref_table_name
+            self.ids = ids
+            # refs记录所有被引用的id及引用它们的id列表
+            self.refs = refs if refs is not None else {id: ids}
+        def __str__(self) -> str:
+            detail = "，".join(f"id为{id}的数据被{self.ref_table_name}表中id为{ids}的数据作为外键引用" for id, ids in self.refs.items())
+            return f"删除违反参照完整性：{self.table_name}表中的{detail}"
+    # 定义一个类内异常类：外键不存在
+    class ForeignKeyNotExistError(Exception):
+        """外键不存在"""
+        def __init__(self, table_name : str, ref_table_name : str, foreign_id : int) -> None:
+            self.table_name = table_name
+            self.ref_table_name = ref_table_name
+            self.foreign_id = foreign_id
+        def __str__(self) -> str:
+            return f"外键不存在：{self.table_name}表中引用的外键\"{self.ref_table_name}ID={self.foreign_id}\"不存在"
+    # 定义一个类内异常类：索引不存在
+    class IndexNotExistError(Exception):
+        """索引不存在"""
+        def __init__(self, table_name : str, index : str) -> None:
+            self.table_name = table_name
+            self.index = index
+        def __str__(self) -> str:
+            return f"索引不存在：{self.table_name}表中的索引\"{self.index}\"不存在"
+    class FieldNotExistError(Exception):
+        """字段不存在"""
+        def __init__(self, table_name : str, field : str) -> None:
+            self.table_name = table_name
+            self.field = field
+        def __str__(self) -> str:
+            return f"字段不存在：{self.table_name}表中的字段\"{self.field}\"不存在"
+
+    class DataDirLockedError(Exception):
+        """数据目录已被其他Model占用"""
+        def __init__(self, data_dir : str) -> None:
+            self.data_dir = data_dir
+        def __str__(self) -> str:
+            return f"数据目录被占用：{self.data_dir}已由其他程序（如导入服务或另一个界面）打开，同一时间只能有一个程序写入，请先关闭它，或以只读方式打开（read_only=True）只做查询"
+
+    class ReadOnlyError(Exception):
+        """以只读方式打开的Model不能增删改"""
+        def __init__(self, data_dir : str) -> None:
+            self.data_dir = data_dir
+        def __str__(self) -> str:
+            return f"只读模式：{self.data_dir}正由其他程序（如导入服务）写入，当前只能查询，不能增删改，请关闭该程序后重新打开"
+
+    # 接下来写增删查改的方法
+
+    def query(self, table_name, return_df = False, orient = "split", **kwargs) -> list:
+        """查询数据，字段允许接受单个值、二元元组代表范围、列表"""
+        # 判断table_name是否为str，如果是则转换为对应的df视图
+        if isinstance(table_name, str):
+            time_range = kwargs.get("时间")
+            df = self.get_df(table_name, time_range if isinstance(time_range, (tuple, str, pd.Timestamp)) else None)
+        else:
+            df = table_name
+        # 只有完整的表才能使用索引和统计信息
+        full_table = isinstance(table_name, str) and df is getattr(self, table_name + "_df")
+        plan = self.plan_query(df, kwargs, table_name if full_table else None)
+        df = self.execute_plan(df, plan)
+        return df if return_df else df.to_dict(orient=orient)
+
+    def explain(self, table_name : str, **kwargs) -> str:
+        """返回查询的执行计划，便于查看各条件的执行顺序与预计行数"""
+        df = self.get_df(table_name)
+        plan = self.plan_query(df, kwargs, table_name)
+        lines = [f"查询计划：{self.eng2chs[table_name]}表（共{len(df)}行）"]
+        for i, step in enumerate(plan, 1):
+            conditions = "，".join(f"{key}={value!r}" for key, value in step["conditions"].items())
+            rows = "未知" if step["rows"] is None else step["rows"]
+            lines.append(f"{i}. {step['access']}：{conditions}  预计{rows}行")
+        return "\n".join(lines)
+
+    def plan_query(self, df : pd.DataFrame, kwargs : dict, table_name : str = None) -> list:
+        """
+        为查询条件制定执行计划，返回步骤列表，每步为{"access": 访问方式, "conditions": 条件, "rows": 预计行数}
+        table_name不为空时可以使用索引：先估算每个条件的选择性，选出预计行数最少的索引条件作为第一步，
+        其余条件按预计行数排序后合并为一个布尔掩码一次筛选
+        """
+        # 去掉空的范围条件
+        kwargs = {key: value for key, value in kwargs.items() if value != ("", "")}
+        if table_name is None:
+            return [{"access": "合并掩码", "conditions": kwargs, "rows": None}] if kwargs else []
+        candidates = []
+        foreign_field = self.get_foreign_field(table_name)
+        for key, value in kwargs.items():
+            if isinstance(value, tuple):
+                continue
+            values = value if isinstance(value, list) else [value]
+            if key == "id":
+                candidates.append({"access": "主键索引", "conditions": {key: value}, "rows": int((self.id_index[table_name].positions(values) >= 0).sum())})
+            elif key == foreign_field:
+                candidates.append({"access": "外键索引", "conditions": {key: value}, "rows": self.fk_index[table_name].count(values)})
+        if table_name == "record" and "时间" in kwargs and not isinstance(kwargs["时间"], list):
+            conditions = {"时间": kwargs["时间"]}
+            if "传感器ID" in kwargs and not isinstance(kwargs["传感器ID"], tuple):
+                conditions["传感器ID"] = kwargs["传感器ID"]
+            candidates.append({"access": "时间排序索引", "conditions": conditions, "rows": self.time_range_count(conditions)})
+        plan = []
+        if candidates:
+            first = min(candidates, key=lambda step: step["rows"])
+            # 索引条件命中的行太多时，按行号取行反而比直接算掩码慢
+            if first["rows"] <= len(df) * 0.3:
+                plan.append(first)
+                kwargs = {key: value for key, value in kwargs.items() if key not in first["conditions"]}
+        # 剩余条件按预计行数从少到多排列，合并为一个掩码
+        estimates = {key: self.estimate_rows(table_name, df, key, value) for key, value in kwargs.items()}
+        for key in sorted(kwargs, key=lambda key: estimates[key]):
+            if plan and plan[-1]["access"] == "合并掩码":
+                plan[-1]["conditions"][key] = kwargs[key]
+                plan[-1]["rows"] = min(plan[-1]["rows"], estimates[key])
+            else:
+                plan.append({"access": "合并掩码", "conditions": {key: kwargs[key]}, "rows": estimates[key]})
+        return plan
+
+    def execute_plan(self, df : pd.DataFrame, plan : list) -> pd.DataFrame:
+        """按执行计划筛选df"""
+        for step in plan:
+            conditions = step["conditions"]
+            if step["access"] == "主键索引":
+                value = conditions["id"]
+                positions = self.id_index[self.table_of(df)].positions(value if isinstance(value, list) else [value])
+                df = df.iloc[np.unique(positions[positions >= 0])]
+            elif step["access"] == "外键索引":
+                (key, value), = conditions.items()
+                table_name = self.table_of(df)
+                ids = self.fk_index[table_name].lookup(value if isinstance(value, list) else [value])
+                df = df.iloc[np.sort(self.id_index[table_name].positions(ids))]
+            elif step["access"] == "时间排序索引":
+                df = df.iloc[self.time_range_positions(conditions)]
+            else:
+                mask = None
+                for key, value in conditions.items():
+                    predicate = self.predicate_mask(df, key, value)
+                    mask = predicate if mask is None else mask & predicate
+                df = df[mask]
+        return df
+
+    def table_of(self, df : pd.DataFrame) -> str:
+        """找出df是哪张表的完整df视图"""
+        for table_name in self.order:
+            if getattr(self, table_name + "_df") is df:
+                return table_name
+
+    @staticmethod
+    def predicate_mask(df : pd.DataFrame, key : str, value) -> pd.Series:
+        """计算单个查询条件的布尔掩码"""
+        if isinstance(value, tuple):
+            left, right = value
+            # category字段无法比较大小，转换为普通对象再比较
+            column = df[key].astype(object) if isinstance(df[key].dtype, pd.CategoricalDtype) else df[key]
+            # 判断有无空字符串
+            if left == "":
+                return column <= right
+            elif right == "":
+                return column >= left
+            return (column >= left) & (column <= right)
+        elif isinstance(value, list):
+            # 时间字段的isin不会自动解析字符串，先转换为时间
+            if pd.api.types.is_datetime64_any_dtype(df[key]):
+                value = pd.to_datetime(value)
+            return df[key].isin(value)
+        return df[key] == value
+
+    def estimate_rows(self, table_name : str, df : pd.DataFrame, key : str, value) -> int:
+        """根据字段统计信息估算满足条件的行数"""
+        stats = self.get_stats(table_name, df, key)
+        rows = len(df)
+        if isinstance(value, tuple):
+            # 数值和时间字段按取值范围线性估算，其他字段按三分之一估算
+            low, high = stats["min"], stats["max"]
+            if low is None or not high > low:
+                return rows // 3
+            convert = pd.Timestamp if isinstance(low, pd.Timestamp) else float
+            try:
+                left = low if value[0] == "" else max(convert(value[0]), low)
+                right = high if value[1] == "" else min(convert(value[1]), high)
+            except (TypeError, ValueError):
+                return rows // 3
+            return int(rows * max((right - left) / (high - low), 0))
+        count = len(value) if isinstance(value, list) else 1
+        return min(rows, count * rows // max(stats["nunique"], 1))
+
+    def get_stats(self, table_name : str, df : pd.DataFrame, key : str) -> dict:
+        """获取字段的统计信息（不同取值个数、最小值、最大值），表的行数变化超过一成时重新统计"""
+        stats = self.column_stats.get((table_name, key))
+        if stats is None or abs(len(df) - stats["rows"]) > len(df) // 10:
+            column = df[key]
+            stats = {"rows": len(df), "nunique": int(column.nunique()), "min": None, "max": None}
+            if len(column) and (pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_any_dtype(column)):
+                stats["min"], stats["max"] = column.min(), column.max()
+                if not isinstance(stats["min"], pd.Timestamp):
+                    stats["min"], stats["max"] = float(stats["min"]), float(stats["max"])
+            self.column_stats[(table_name, key)] = stats
+        return stats
+
+    def record_time_index(self) -> RecordTimeIndex:
+        """获取测量记录表的时间排序索引，尚未建立时先建立"""
+        if self.record_index is None:
+            self.record_index = RecordTimeIndex(self.record_df)
+        return self.record_index
+
+    def split_time_conditions(self, conditions : dict) -> tuple:
+        """把时间排序索引的条件拆分为传感器ID列表与时间范围"""
+        time_range = conditions["时间"]
+        start, end = time_range if isinstance(time_range, tuple) else (time_range, time_range)
+        sensor_ids = conditions.get("传感器ID", self.record_time_index().sensors())
+        if not isinstance(sensor_ids, list):
+            sensor_ids = [sensor_ids]
+        return sensor_ids, start, end
+
+    def time_range_count(self, conditions : dict) -> int:
+        """用时间排序索引统计满足时间（及传感器ID）条件的记录数"""
+        return self.record_time_index().count(*self.split_time_conditions(conditions))
+
+    def time_range_positions(self, conditions : dict) -> np.ndarray:
+        """用时间排序索引找出满足时间（及传感器ID）条件的记录行号"""
+        return self.record_time_index().lookup(*self.split_time_conditions(conditions))
+    
+    def aggregate(self, sensor_ids = None, start = "", end = "", freq : str = "1h", funcs : list = ("mean", "min", "max", "count")) -> pd.DataFrame:
+        """
+        按传感器和时间间隔汇总测量值，返回每个传感器每个时间桶一行的结果
+        sensor_ids为单个传感器ID或列表，为None时汇总所有传感器；start、end为空字符串时不限起止时间
+        freq是小时或天的整数倍、funcs都能由预汇总表算出时，完整的时间桶直接读预汇总表，只有起止时间所在的不完整时间桶读取原始记录
+        """
+        kwargs = {}
+        if sensor_ids is not None:
+            sensor_ids = sensor_ids if isinstance(sensor_ids, list) else [sensor_ids]
+            kwargs["传感器ID"] = sensor_ids
+        name = self.choose_rollup(freq, funcs)
+        # 时间排序索引可用且命中的原始记录不多时，直接汇总原始记录比扫描预汇总表更快
+        if name is not None and self.record_df is not None and self.time_range_count({"时间": (start or "", end or ""), **kwargs}) <= 10000:
+            name = None
+        if name is not None:
+            step = pd.Timedelta(rollup_steps[name])
+            # 范围内第一个完整时间桶的起点与最后一个完整时间桶的终点
+            first = pd.Timestamp(start).ceil(step) if start else None
+            last = (pd.Timestamp(end) + pd.Timedelta(seconds=1)).floor(step) if end else None
+            if first is None or last is None or first < last:
+                parts = [self.get_rollup(name).select(sensor_ids, first, last)]
+                edges = []
+                if first is not None and pd.Timestamp(start) < first:
+                    edges.append((start, str(first - pd.Timedelta(seconds=1))))
+                if last is not None and last <= pd.Timestamp(end):
+                    edges.append((str(last), end))
+                for edge in edges:
+                    rows = self.query("record", return_df=True, 时间=edge, **kwargs)
+                    parts.append(summarize_records(rows, rollup_steps[name]))
+                return aggregate_summaries(pd.concat(parts, ignore_index=True), freq, funcs)
+        rows = self.query("record", return_df=True, 时间=(start or "", end or ""), **kwargs)
+        return aggregate_records(rows, freq, funcs)
+
+    def choose_rollup(self, freq : str, funcs : list) -> str:
+        """选择能回答该汇总查询的最粗粒度预汇总表，没有时返回None"""
+        if not set(funcs) <= rollup_funcs:
+            return None
+        try:
+            step = pd.Timedelta(pd.tseries.frequencies.to_offset(freq))
+        except ValueError:
+            # 按天、按周、按月等日历间隔，每个区间都由整天组成
+            return "day"
+        for name in ("day", "hour"):
+            if step % pd.Timedelta(rollup_steps[name]) == pd.Timedelta(0):
+                return name
+        return None
+
+    def get_rollup(self, name : str) -> RecordRollup:
+        """获取预汇总表，第一次使用时读取文件，文件不存在时从整张测量记录表建立并保存"""
+        rollup = self.rollups[name]
+        if rollup.table is None:
+            if rollup.exists():
+                rollup.load()
+            else:
+                rollup.build(self.get_df("record"))
+                # 事务中的测量记录表含有尚未提交的改动，暂不保存；只读方式不写文件
+                if self.changes is None and not self.read_only:
+                    rollup.save()
+        return rollup
+
+    def refresh_rollups(self, keys : pd.DataFrame):
+        """记录被修改或删除后，重新计算各预汇总表中keys所在的时间桶"""
+        for name, rollup in self.rollups.items():
+            # 尚未建立的汇总表以后会从测量记录表完整建立，无需修补
+            if rollup.table is None and not rollup.exists():
+                continue
+            self.get_rollup(name).refresh(self.record_df, keys)
+
+    def insert(self, table_name: str, **kwargs):
+        """插入数据"""
+        self.insert_many(table_name, [kwargs])
+
+    def insert_many(self, table_name : str, rows) -> list:
+        """批量插入数据，rows为字典列表或DataFrame，返回新行的id列表"""
+        self.check_writable()
+        new_rows = rows.copy() if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+        if new_rows.empty:
+            return []
+        # 表中没有的字段追加到表文件末尾会与表头对不上，直接拒绝
+        self.check_fields(table_name, new_rows.columns)
+        # 一次性检查所有外键是否存在
+        self.raise_foreign_keys(table_name, new_rows)
+        df = getattr(self, table_name + "_df")
+        if df is None and self.changes is not None:
+            # 事务中的改动要能撤销，不直接追加到分区，先读取整张测量记录表
+            df = self.get_df(table_name)
+        if df is None:
+            # 懒加载模式下测量记录表尚未读取，直接追加到所属分区，并让缓存中的这些分区失效
+            new_id = self.storage.next_id(table_name)
+            new_rows["id"] = range(new_id, new_id + len(new_rows))
+            new_rows = self.conform(table_name, new_rows)
+            self.append_df(table_name, new_rows)
+            for key in set(self.storage.partition_keys(new_rows["时间"])):
+                self.record_cache.pop(key, None)
+            for rollup in self.rollups.values():
+                rollup.add(new_rows)
+            self.persist_rollups(new_rows)
+            return new_rows["id"].tolist()
+        # 为新行分配连续的id
+        new_id = df["id"].max()
+        new_id = 0 if new_id != new_id else new_id + 1
+        new_rows["id"] = range(new_id, new_id + len(new_rows))
+        new_rows = self.conform(table_name, new_rows)
+        self.add_index(table_name, new_rows, len(df))
+        df = pd.concat([df, new_rows], ignore_index=True)
+        setattr(self, table_name + "_df", df)
+        self.patch_views_insert(table_name, new_rows)
+        if table_name == "record":
+            for rollup in self.rollups.values():
+                rollup.add(new_rows)
+        self.persist(table_name, new_rows)
+        return new_rows["id"].tolist()
+    
+    def update(self, table_name : str, id, **kwargs) -> int:
+        """
+        更新数据，id可以是单个id、id列表，或与query参数格式相同的筛选条件字典（如{"传感器ID": 3, "时间": (start, end)}）
+        所有行一次赋值，外键只检查一次，只持久化一次，返回修改的行数
+        """
+        self.check_writable()
+        df = self.get_df(table_name)
+        self.check_fields(table_name, kwargs)
+        if isinstance(id, dict):
+            ids = self.query(table_name, return_df=True, **id)["id"].tolist()
+        else:
+            ids = list(dict.fromkeys(id if isinstance(id, list) else [id]))
+        rows = self.id_index[table_name].positions(ids)
+        # 检查id是否存在，如果不存在，引发索引不存在异常
+        if (rows < 0).any():
+            raise self.IndexNotExistError(self.eng2chs[table_name], ids[int(np.argmax(rows < 0))])
+        if not ids or not kwargs:
+            return 0
+        # 先把新值转换为表中字段的类型，如果修改了外键，检查外键是否存在，都通过后再修改
+        values = self.conform(table_name, pd.DataFrame([kwargs]))
+        column = self.get_foreign_field(table_name)
+        if column in kwargs.keys():
+            self.raise_foreign_key(table_name, kwargs)
+            # 同步外键反向索引
+            self.fk_index[table_name].move(ids, kwargs[column])
+        old_keys = df.loc[rows, ["传感器ID", "时间"]] if table_name == "record" else None
+        for field in kwargs:
+            if self.undo is not None:
+                self.undo.append((df, rows, field, df[field].to_numpy()[rows].copy(), df[field].dtype))
+            df.loc[rows, field] = values[field].iloc[0]
+        setattr(self, table_name + "_df", df)
+        if self.record_index is not None and table_name == "record" and ("时间" in kwargs or "传感器ID" in kwargs):
+            # 只把被修改的行移出原来的传感器，按新的传感器和时间重新暂存
+            self.record_index.remove(old_keys["传感器ID"].to_numpy(), rows)
+            self.record_index.add(df["传感器ID"].to_numpy()[rows], RecordTimeIndex.to_int(df["时间"].to_numpy()[rows]), rows)
+        if old_keys is not None:
+            # 修改前后所在的时间桶都需要重新汇总
+            self.refresh_rollups(pd.concat([old_keys, df.loc[rows, ["传感器ID", "时间"]]]))
+        self.patch_views_update(table_name, ids, kwargs)
+        self.persist(table_name, ids=ids, values=kwargs)
+        return len(ids)
+
+    def delete(self, table_name : str, ids : list, cascade : bool = False):
+        """删除数据，cascade为True时级联删除所有下层表中引用这些数据的项"""
+        self.check_writable()
+        if not isinstance(ids, list):
+            ids = [ids]
+        # 只保留存在的id，延迟加载的表要先读入并建立索引
+        self.get_df(table_name)
+        ids = [id for id, row in zip(ids, self.id_index[table_name].positions(ids)) if row >= 0]
+        if not ids:
+            return
+        index = self.order.index(table_name)
+        targets = {table_name: ids}
+        # 沿层级向下一次性收集所有引用项
+        for parent_name, child_name in zip(self.order[index:], self.order[index + 1:]):
+            ref_table_name, refs = self.get_foreign_keys(parent_name, ids)
+            if not refs:
+                break
+            if not cascade:
+                first_id = next(iter(refs))
+                raise self.DelReferentialIntegrityError(self.eng2chs[table_name], first_id, ref_table_name, refs[first_id], refs)
+            ids = [child_id for child_ids in refs.values() for child_id in child_ids]
+            targets[child_name] = ids
+        # 从下层表开始删除
+        for name in reversed(list(targets)):
+            df = self.get_df(name)
+            removed = df["id"].isin(targets[name])
+            old_keys = df.loc[removed, ["传感器ID", "时间"]] if name == "record" else None
+            df = df[~removed].reset_index(drop=True)
+            setattr(self, name + "_df", df)
+            # 删除后行号发生变化，平移索引中的行号
+            self.remove_index(name, removed.to_numpy(), targets[name])
+            if old_keys is not None:
+                self.refresh_rollups(old_keys)
+            self.patch_views_delete(name, removed.to_numpy())
+            self.persist(name, ids=targets[name])
+
+    # 检查给定表主键是否被其他表作为外键引用，若有则返回其他表中引用项的id
+    def get_foreign_key(self, table_name : str, id : int) -> list:
+        """检查给定表主键是否被其他表作为外键引用"""
+        # 如果是record表，直接返回空列表
+        if table_name == "record":
+            return (None,[])
+        # 获取给定表的层次顺序
+        table_order = self.order.index(table_name)
+        # 在下一层次表的外键反向索引中找到外键为给定id的项
+        self.get_df(self.order[table_order + 1])
+        id_list = self.fk_index[self.order[table_order + 1]].get(id).tolist()
+        # 返回下一层次表的id列表
+        return (self.name_list[table_order+1],id_list)
+    
+    # 批量检查给定表主键是否被下一层次表引用，返回下一层次表名与{被引用的id: 引用项id列表}
+    def get_foreign_keys(self, table_name : str, ids : list) -> tuple:
+        """批量检查给定表主键是否被其他表作为外键引用"""
+        if table_name == "record":
+            return (None, {})
+        table_order = self.order.index(table_name)
+        # 确保下一层次表已读取，其外键反向索引可用
+        self.get_df(self.order[table_order + 1])
+        refs = self.fk_index[self.order[table_order + 1]].groups(ids)
+        return (self.name_list[table_order + 1], refs)
+
+    # 检查外键是否存在
+    def check_foreign_key(self, table_name : str, foreign_id : int) -> bool:
+        """检查外键是否存在"""
+        # 如果是station表，直接返回True
+        if table_name == "station":
+            return True
+        # 获取给定表的层次顺序
+        table_order = self.order.index(table_name)
+        # 在上一层次表的主键索引中查找给定外键
+        return foreign_id in self.id_index[self.order[table_order - 1]]
+
+    # 引发外键不存在的异常
+    def raise_foreign_key(self,table_name : str, kwargs : dict):
+        # 检查外键是否存在
+        index = self.order.index(table_name)
+        zh_ref_table_name = self.name_list[index - 1]
+        zh_table_name = self.name_list[index]
+        foreign_id = kwargs.get(zh_ref_table_name + "ID", None)
+        if not self.check_foreign_key(table_name, foreign_id):
+            raise self.ForeignKeyNotExistError(zh_table_name, zh_ref_table_name, foreign_id)
+
+    # 批量检查外键，若有不存在的外键则以第一个为例引发异常
+    def raise_foreign_keys(self, table_name : str, df : pd.DataFrame):
+        if table_name == "station":
+            return
+        index = self.order.index(table_name)
+        zh_ref_table_name = self.name_list[index - 1]
+        zh_table_name = self.name_list[index]
+        column = zh_ref_table_name + "ID"
+        if column not in df.columns:
+            raise self.ForeignKeyNotExistError(zh_table_name, zh_ref_table_name, None)
+        ref_df = getattr(self, self.order[index - 1] + "_df")
+        missing = df.loc[~df[column].isin(ref_df["id"]), column]
+        if not missing.empty:
+            raise self.ForeignKeyNotExistError(zh_table_name, zh_ref_table_name, missing.iloc[0])
+
+    # 接下来写联表查询的方法，使用循环结构根据层次表顺序向前联合查询，使用merge方法
+    def union_query(self, table_name : str, return_df = False, orient = "split", **kwargs):
+        """
+        向前联表查询
+        上层表字段的条件先在上层表中筛选出id集合，再作为外键的isin条件下推到被查询的表，最后只连接筛选出的行；
+        没有条件时返回整个联表视图，有条件且已建立视图时按筛选出的行号从视图中取行，视图的第i行就是表的第i行
+        """
+        index = self.order.index(table_name)
+        # 按字段所属的表拆分条件，id属于被查询的表
+        owner = {field: table_name for field in self.get_fields(table_name)}
+        for parent in self.order[:index]:
+            for field in self.get_fields(parent):
+                if field != "id":
+                    owner[field] = parent
+        conditions = {name: {} for name in self.order[:index + 1]}
+        for key, value in kwargs.items():
+            if key not in owner:
+                raise self.FieldNotExistError(self.eng2chs[table_name], key)
+            conditions[owner[key]][key] = value
+        if not kwargs:
+            df = self.get_union_view(table_name)
+            return df if return_df else df.to_dict(orient=orient)
+        # 自上而下逐层筛选，把上一层筛选出的id作为外键条件下推到下一层
+        allowed = None
+        for name in self.order[:index + 1]:
+            level_conditions = conditions[name]
+            if allowed is None and not level_conditions and name != table_name:
+                continue
+            foreign_field = self.get_foreign_field(name)
+            pushed = None
+            if allowed is not None:
+                # 已有该外键的条件时，下推的id集合在查询后再筛选
+                if foreign_field in level_conditions:
+                    pushed = allowed
+                else:
+                    level_conditions[foreign_field] = allowed
+            rows = self.query(name, return_df=True, **level_conditions)
+            if pushed is not None:
+                rows = rows[rows[foreign_field].isin(pushed)]
+            allowed = rows["id"].tolist()
+        # 只连接筛选出的行，已建立视图时直接取出这些行在上层表中的行号
+        view = self.union_views.get(table_name)
+        if view is not None:
+            positions = view.iloc[self.id_index[table_name].positions(rows["id"].to_numpy())]
+        else:
+            positions = self.parent_positions(table_name, rows)
+        df = self.join_rows(table_name, rows, positions)
+        return df if return_df else df.to_dict(orient=orient)
+
+    def join_parents(self, table_name : str, df : pd.DataFrame) -> pd.DataFrame:
+        """把df依次与上层各表左连接，得到联表查询结果中的行"""
+        return self.join_rows(table_name, df, self.parent_positions(table_name, df))
+
+    def parent_positions(self, table_name : str, df : pd.DataFrame) -> pd.DataFrame:
+        """沿外键逐层用主键索引找到df每行在各上层表中的行号，列名为上层表名，没有对应的行时为-1"""
+        index = self.order.index(table_name)
+        positions = {}
+        keys = df[self.get_foreign_field(table_name)].to_numpy() if index > 0 else None
+        for i in range(index - 1, -1, -1):
+            parent = self.order[i]
+            rows = self.id_index[parent].positions(keys)
+            positions[parent] = rows.astype("int32")
+            if i > 0:
+                # 上一层的外键值，找不到的行传下去的-1不是任何表的id
+                foreign_keys = getattr(self, parent + "_df")[self.get_foreign_field(parent)].to_numpy()
+                keys = np.where(rows >= 0, foreign_keys[np.maximum(rows, 0)] if len(foreign_keys) else -1, -1)
+        return pd.DataFrame(positions, index=range(len(df)))
+
+    def join_rows(self, table_name : str, df : pd.DataFrame, positions : pd.DataFrame) -> pd.DataFrame:
+        """
+        按各上层表的行号取出上层表的字段拼到df右侧，效果与逐层左连接相同
+        上层表中的字符串字段转换为category，取值重复的字段只保存编号
+        """
+        columns = {column: df[column].to_numpy() for column in df.columns}
+        index = self.order.index(table_name)
+        for i in range(index - 1, -1, -1):
+            parent = self.order[i]
+            parent_df = getattr(self, parent + "_df")
+            rows = positions[parent].to_numpy()
+            for column in parent_df.columns:
+                if column == "id" or column in columns:
+                    continue
+                values = parent_df[column].array
+                if pd.api.types.is_object_dtype(values.dtype) or pd.api.types.is_string_dtype(values.dtype) and not isinstance(values.dtype, pd.CategoricalDtype):
+                    values = pd.Categorical(values)
+                columns[column] = pd.api.extensions.take(values, rows, allow_fill=True)
+        return pd.DataFrame(columns, index=range(len(df)))
+
+    def get_union_view(self, table_name : str) -> pd.DataFrame:
+        """
+        获取整张表的联表查询结果；联表视图只保存表的第i行在各上层表中的行号，建立后随增删改增量修补，
+        结果中的上层表字段每次查询时按行号取出
+        station表没有上层表，直接返回表本身
+        """
+        if table_name == "station":
+            return self.station_df
+        df = self.get_df(table_name)
+        view = self.union_views.get(table_name)
+        if view is None:
+            view = self.parent_positions(table_name, df)
+            self.union_views[table_name] = view
+            self.view_counters["build"] += 1
+        return self.join_rows(table_name, df, view)
+
+    def invalidate_views(self):
+        """丢弃所有联表视图，下次联表查询时重新建立"""
+        if self.union_views:
+            self.union_views.clear()
+            self.view_counters["invalidate"] += 1
+
+    def patch_views_insert(self, table_name : str, new_rows : pd.DataFrame):
+        """插入后把新行在上层表中的行号追加到该表的联表视图末尾；上层表的新行追加在末尾，其他视图中的行号不变"""
+        view = self.union_views.get(table_name)
+        if view is None:
+            return
+        self.union_views[table_name] = pd.concat([view, self.parent_positions(table_name, new_rows)], ignore_index=True)
+        self.view_counters["patch"] += 1
+
+    def patch_views_update(self, table_name : str, ids : list, values : dict):
+        """修改了外键时，重新查找该表及所有下层视图中受影响的行在上层表中的行号；其他字段在查询时才取出，无需修补"""
+        if self.get_foreign_field(table_name) not in values:
+            return
+        index = self.order.index(table_name)
+        for level in self.order[index:]:
+            # 沿外键反向索引向下找到受影响的行
+            if level != table_name:
+                ids = self.fk_index[level].lookup(ids).tolist()
+            view = self.union_views.get(level)
+            if view is None or not ids:
+                continue
+            positions = np.sort(self.id_index[level].positions(ids))
+            rows = self.parent_positions(level, getattr(self, level + "_df").iloc[positions])
+            view.iloc[positions] = rows[view.columns].to_numpy()
+            self.view_counters["patch"] += 1
+
+    def patch_views_delete(self, table_name : str, removed : np.ndarray):
+        """
+        删除后从该表的联表视图中去掉相同的行，removed为按删除前行号的布尔掩码；
+        下层视图中指向该表的行号减去其前面被删除的行数
+        """
+        view = self.union_views.get(table_name)
+        if view is not None:
+            self.union_views[table_name] = view[~removed].reset_index(drop=True)
+            self.view_counters["patch"] += 1
+        shift = np.cumsum(removed)
+        for level in self.order[self.order.index(table_name) + 1:]:
+            view = self.union_views.get(level)
+            if view is None or not len(removed):
+                continue
+            rows = view[table_name].to_numpy()
+            # 引用被删除行的下层行已先被级联删除，剩下的只需平移
+            view[table_name] = np.where(rows >= 0, rows - shift[np.maximum(rows, 0)], -1).astype("int32")
+            self.view_counters["patch"] += 1
+
+    # 写一个获取表字段的方法
+    def get_fields(self, table_name : str):
+        """获取表字段"""
+        df = getattr(self, table_name + "_df")
+        return df.columns.tolist() if df is not None else list(table_fields[table_name])
+
+    def check_fields(self, table_name : str, fields):
+        """检查字段是否存在，不存在时引发字段不存在异常"""
+        known = self.get_fields(table_name)
+        for field in fields:
+            if field not in known:
+                raise self.FieldNotExistError(self.eng2chs[table_name], field)
+    
+    # 写一个筛选字段的方法（还可以给字段排序）
+    def filter_field(self, df, fields : list, return_df = False, orient = "split"):
+        """筛选字段"""
+        # 判断df是否为dict列表，若是则转换为DataFrame
+        if isinstance(df, list):
+            df = pd.DataFrame(df)
+        # 捕获异常，如果字段不存在，抛出异常
+        try:
+            return df[fields] if return_df else df[fields].to_dict(orient=orient)
+        except KeyError as e:
+           raise self.FieldNotExistError(e.args[0], e.args[1])
+        
+class SqliteModel():
+    """
+    基于sqlite3的数据模型，接口与Model一致
+    数据保存在data目录下的数据库文件中，id、外键和时间字段建有索引，查询与联表查询都翻译成SQL在数据库内完成
+    """
+    # 与Model共用异常类
+    DelReferentialIntegrityError = Model.DelReferentialIntegrityError
+    ForeignKeyNotExistError = Model.ForeignKeyNotExistError
+    IndexNotExistError = Model.IndexNotExistError
+    FieldNotExistError = Model.FieldNotExistError
+    # 对传入的DataFrame筛选时与Model共用执行计划
+    plan_query = Model.plan_query
+    execute_plan = Model.execute_plan
+    predicate_mask = staticmethod(Model.predicate_mask)
+    # 字段存储类型与SQLite类型的对应关系
+    sql_types = {"int": "INTEGER", "float": "REAL", "str": "TEXT", "datetime": "TEXT"}
+    # 时间字段统一存为该格式的文本，按文本比较大小与按时间比较一致，范围查询才能用上索引
+    time_format = "%Y-%m-%d %H:%M:%S"
+    time_fields = {field for fields in table_fields.values() for field, kind in fields.items() if kind == "datetime"}
+    # 数据库格式版本，1表示时间字段已统一格式
+    schema_version = 1
+
+    def __init__(self, path : str = os.path.join(data_dir, "weather.db")) -> None:
+        """初始化数据模型，path为数据库文件路径"""
+        self.eng2chs = {"station": "测量站", "place": "地点", "sensor": "传感器", "record": "测量记录"}
+        self.order = ["station", "place", "sensor", "record"] # 层级表
+        self.name_list = ["测量站", "地点", "传感器", "测量记录"] # 名称表
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # 界面在后台线程中调用数据模型，连接需要允许在创建它的线程之外使用
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.in_transaction = False
+        self.create_tables()
+
+    def create_tables(self):
+        """建表并建立索引"""
+        with self.conn:
+            for table_name in self.order:
+                columns = []
+                for field, kind in table_fields[table_name].items():
+                    if field == "id":
+                        columns.append('"id" INTEGER PRIMARY KEY')
+                    else:
+                        columns.append(f'"{field}" {self.sql_types[kind]}')
+                foreign_field = self.get_foreign_field(table_name)
+                if foreign_field:
+                    parent = self.order[self.order.index(table_name) - 1]
+                    columns.append(f'FOREIGN KEY ("{foreign_field}") REFERENCES {parent}("id")')
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table_name} ({", ".join(columns)})')
+                if foreign_field:
+                    self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table_name}_fk ON {table_name}("{foreign_field}")')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_record_time ON record("时间")')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_record_sensor_time ON record("传感器ID", "时间")')
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] < self.schema_version:
+                self.normalize_times()
+                self.conn.execute(f"PRAGMA user_version = {self.schema_version}")
+
+    def normalize_times(self):
+        """把旧数据库中格式不统一的时间（如"2023-6-5 9:00"）改写为time_format格式"""
+        pattern = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]"
+        for table_name in self.order:
+            for field in self.time_fields & set(table_fields[table_name]):
+                rows = self.conn.execute(f'SELECT id, "{field}" FROM {table_name} WHERE "{field}" NOT GLOB ?', (pattern,)).fetchall()
+                if rows:
+                    ids, times = zip(*rows)
+                    times = self.to_sql_times(pd.Series(times))
+                    self.conn.executemany(f'UPDATE {table_name} SET "{field}" = ? WHERE id = ?', zip(times, ids))
+
+    def load_from(self, storage):
+        """从其他存储后端（如CsvStorage）一次性导入四张表，会覆盖数据库中已有数据"""
+        with self.conn:
+            for table_name in reversed(self.order):
+                self.conn.execute(f"DELETE FROM {table_name}")
+            for table_name in self.order:
+                df = storage.load(table_name)
+                self.execute_insert(table_name, df)
+
+    def compact(self):
+        """整理数据库文件"""
+        self.conn.execute("VACUUM")
+
+    def close(self):
+        """关闭数据库连接"""
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """事务：其中的改动一起提交，引发异常时一起回滚；增删改各自也是一个事务，在事务中调用时并入外层事务"""
+        if self.in_transaction:
+            yield self
+            return
+        self.in_transaction = True
+        try:
+            with self.conn:
+                yield self
+        finally:
+            self.in_transaction = False
+
+    def recent_range(self):
+        """数据库按需读取，不需要限制默认显示范围"""
+        return None
+
+    def get_foreign_field(self, table_name : str) -> str:
+        """获取表中外键字段名，station表没有外键，返回None"""
+        index = self.order.index(table_name)
+        return self.name_list[index - 1] + "ID" if index > 0 else None
+
+    @staticmethod
+    def to_sql_value(value):
+        """把pandas/NumPy的值转换为sqlite3可以接受的Python值"""
+        if isinstance(value, (pd.Timestamp, np.datetime64)):
+            return str(pd.Timestamp(value))
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, float) and value != value:
+            return None
+        return value
+
+    @classmethod
+    def to_sql_time(cls, value):
+        """把时间字段的取值转换为time_format格式的文本，范围查询中表示不限的空字符串保持不变"""
+        if value == "" or value is None:
+            return value
+        return pd.Timestamp(value).strftime(cls.time_format)
+
+    @classmethod
+    def to_sql_times(cls, values : pd.Series) -> list:
+        """批量转换时间字段，无法解析的时间引发ValueError，缺失值存为NULL"""
+        times = pd.to_datetime(values, format="mixed").dt.strftime(cls.time_format)
+        return [None if time != time else time for time in times]
+
+    def build_where(self, kwargs : dict, owner : dict = None) -> tuple:
+        """把查询条件翻译成WHERE子句，owner为字段到表别名的映射"""
+        clauses, params = [], []
+        for key, value in kwargs.items():
+            column = f'{owner[key]}."{key}"' if owner else f'"{key}"'
+            if key in self.time_fields:
+                # 查询条件中的时间按存储格式转换后再比较
+                if isinstance(value, tuple):
+                    value = tuple(self.to_sql_time(bound) for bound in value)
+                elif isinstance(value, list):
+                    value = [self.to_sql_time(item) for item in value]
+                else:
+                    value = self.to_sql_time(value)
+            if isinstance(value, tuple):
+                left, right = value
+                # 判断有无空字符串
+                if left == "" and right == "":
+                    continue
+                elif left == "":
+                    clauses.append(f"{column} <= ?")
+                    params.append(right)
+                elif right == "":
+                    clauses.append(f"{column} >= ?")
+                    params.append(left)
+                else:
+                    clauses.append(f"{column} BETWEEN ? AND ?")
+                    params.extend([left, right])
+            elif isinstance(value, list):
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return where, [self.to_sql_value(param) for param in params]
+
+    def check_fields(self, table_name : str, fields):
+        """检查字段是否存在"""
+        for field in fields:
+            if field not in table_fields[table_name]:
+                raise self.FieldNotExistError(self.eng2chs[table_name], field)
+
+    def query(self, table_name, return_df = False, orient = "split", **kwargs) -> list:
+        """查询数据，字段允许接受单个值、二元元组代表范围、列表"""
+        # 传入DataFrame时退回到内存中筛选
+        if not isinstance(table_name, str):
+            return Model.query(self, table_name, return_df, orient, **kwargs)
+        self.check_fields(table_name, kwargs)
+        where, params = self.build_where(kwargs)
+        df = pd.read_sql_query(f"SELECT * FROM {table_name}{where} ORDER BY id", self.conn, params=params)
+        return df if return_df else df.to_dict(orient=orient)
+
+    def aggregate(self, sensor_ids = None, start = "", end = "", freq : str = "1h", funcs : list = ("mean", "min", "max", "count")) -> pd.DataFrame:
+        """按传感器和时间间隔汇总测量值，数据库按条件取出记录后与Model使用同样的方式汇总"""
+        kwargs = {"时间": (start or "", end or "")}
+        if sensor_ids is not None:
+            kwargs["传感器ID"] = sensor_ids if isinstance(sensor_ids, list) else [sensor_ids]
+        rows = self.query("record", return_df=True, **kwargs)
+        rows["时间"] = pd.to_datetime(rows["时间"])
+        return aggregate_records(rows, freq, funcs)
+
+    def execute_insert(self, table_name : str, df : pd.DataFrame):
+        """把df中的行插入到表中，不做检查"""
+        fields = [field for field in table_fields[table_name] if field in df.columns]
+        columns = ", ".join(f'"{field}"' for field in fields)
+        sql = f"INSERT INTO {table_name} ({columns}) VALUES ({', '.join('?' * len(fields))})"
+        df = df[fields].copy()
+        for field in self.time_fields.intersection(fields):
+            df[field] = pd.Series(self.to_sql_times(df[field]), index=df.index, dtype=object)
+        rows = ([self.to_sql_value(value) for value in row] for row in df.itertuples(index=False, name=None))
+        self.conn.executemany(sql, rows)
+
+    def next_id(self, table_name : str) -> int:
+        """获取下一个可用的id"""
+        return self.conn.execute(f"SELECT COALESCE(MAX(id) + 1, 0) FROM {table_name}").fetchone()[0]
+
+    def insert(self, table_name : str, **kwargs):
+        """插入数据"""
+        self.insert_many(table_name, [kwargs])
+
+    def insert_many(self, table_name : str, rows) -> list:
+        """批量插入数据，rows为字典列表或DataFrame，返回新行的id列表"""
+        new_rows = rows.copy() if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+        if new_rows.empty:
+            return []
+        with self.transaction():
+            self.raise_foreign_keys(table_name, new_rows)
+            new_id = self.next_id(table_name)
+            new_rows["id"] = range(new_id, new_id + len(new_rows))
+            self.execute_insert(table_name, new_rows)
+        return new_rows["id"].tolist()
+
+    def update(self, table_name : str, id, **kwargs) -> int:
+        """更新数据，id可以是单个id、id列表或与query参数格式相同的筛选条件字典，用一条UPDATE语句修改，返回修改的行数"""
+        self.check_fields(table_name, kwargs)
+        if isinstance(id, dict):
+            self.check_fields(table_name, id)
+        with self.transaction():
+            if isinstance(id, dict):
+                where, where_params = self.build_where(id)
+            else:
+                # 检查id是否存在，如果不存在，引发索引不存在异常
+                ids = list(dict.fromkeys(id if isinstance(id, list) else [id]))
+                existing = set()
+                for chunk in self.chunks(ids):
+                    existing.update(row[0] for row in self.conn.execute(f"SELECT id FROM {table_name} WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+                for i in ids:
+                    if self.to_sql_value(i) not in existing:
+                        raise self.IndexNotExistError(self.eng2chs[table_name], i)
+            if not kwargs:
+                return 0
+            # 如果修改了外键，检查外键是否存在
+            if self.get_foreign_field(table_name) in kwargs.keys():
+                self.raise_foreign_key(table_name, kwargs)
+            assignments = ", ".join(f'"{key}" = ?' for key in kwargs)
+            params = [self.to_sql_time(value) if key in self.time_fields else self.to_sql_value(value) for key, value in kwargs.items()]
+            if isinstance(id, dict):
+                return self.conn.execute(f"UPDATE {table_name} SET {assignments}{where}", params + where_params).rowcount
+            count = 0
+            for chunk in self.chunks(ids):
+                count += self.conn.execute(f"UPDATE {table_name} SET {assignments} WHERE id IN ({', '.join('?' * len(chunk))})", params + chunk).rowcount
+            return count
+
+    def delete(self, table_name : str, ids : list, cascade : bool = False):
+        """删除数据，cascade为True时级联删除所有下层表中引用这些数据的项"""
+        if not isinstance(ids, list):
+            ids = [ids]
+        index = self.order.index(table_name)
+        targets = {table_name: ids}
+        with self.transaction():
+            # 沿层级向下收集所有引用项
+            for parent_name, child_name in zip(self.order[index:], self.order[index + 1:]):
+                ref_table_name, refs = self.get_foreign_keys(parent_name, ids)
+                if not refs:
+                    break
+                if not cascade:
+                    first_id = next(iter(refs))
+                    raise self.DelReferentialIntegrityError(self.eng2chs[table_name], first_id, ref_table_name, refs[first_id], refs)
+                ids = [child_id for child_ids in refs.values() for child_id in child_ids]
+                targets[child_name] = ids
+            # 从下层表开始删除
+            for name in reversed(list(targets)):
+                for chunk in self.chunks(targets[name]):
+                    self.conn.execute(f"DELETE FROM {name} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+
+    @staticmethod
+    def chunks(values : list, size : int = 500):
+        """把参数列表切分成小段，避免超过SQLite的参数个数上限"""
+        values = [SqliteModel.to_sql_value(value) for value in values]
+        for i in range(0, len(values), size):
+            yield values[i:i + size]
+
+    def get_foreign_key(self, table_name : str, id : int) -> list:
+        """检查给定表主键是否被其他表作为外键引用"""
+        ref_table_name, refs = self.get_foreign_keys(table_name, [id])
+        return (ref_table_name, refs.get(id, []))
+
+    def get_foreign_keys(self, table_name : str, ids : list) -> tuple:
+        """批量检查给定表主键是否被其他表作为外键引用"""
+        if table_name == "record":
+            return (None, {})
+        table_order = self.order.index(table_name)
+        child_name = self.order[table_order + 1]
+        column = self.name_list[table_order] + "ID"
+        refs = {}
+        for chunk in self.chunks(ids):
+            sql = f'SELECT "{column}", id FROM {child_name} WHERE "{column}" IN ({", ".join("?" * len(chunk))}) ORDER BY id'
+            for key, child_id in self.conn.execute(sql, chunk):
+                refs.setdefault(key, []).append(child_id)
+        return (self.name_list[table_order + 1], refs)
+
+    def check_foreign_key(self, table_name : str, foreign_id : int) -> bool:
+        """检查外键是否存在"""
+        if table_name == "station":
+            return True
+        parent = self.order[self.order.index(table_name) - 1]
+        return self.conn.execute(f"SELECT 1 FROM {parent} WHERE id = ?", (self.to_sql_value(foreign_id),)).fetchone() is not None
+
+    def raise_foreign_key(self, table_name : str, kwargs : dict):
+        """引发外键不存在的异常"""
+        self.raise_foreign_keys(table_name, pd.DataFrame([kwargs]))
+
+    def raise_foreign_keys(self, table_name : str, df : pd.DataFrame):
+        """批量检查外键，若有不存在的外键则以第一个为例引发异常"""
+        if table_name == "station":
+            return
+        index = self.order.index(table_name)
+        zh_ref_table_name = self.name_list[index - 1]
+        zh_table_name = self.name_list[index]
+        column = zh_ref_table_name + "ID"
+        if column not in df.columns:
+            raise self.ForeignKeyNotExistError(zh_table_name, zh_ref_table_name, None)
+        foreign_ids = df[column].drop_duplicates().tolist()
+        existing = set()
+        for chunk in self.chunks(foreign_ids):
+            sql = f"SELECT id FROM {self.order[index - 1]} WHERE id IN ({', '.join('?' * len(chunk))})"
+            existing.update(row[0] for row in self.conn.execute(sql, chunk))
+        for foreign_id in foreign_ids:
+            if foreign_id not in existing:
+                raise self.ForeignKeyNotExistError(zh_table_name, zh_ref_table_name, foreign_id)
+
+    def union_query(self, table_name : str, return_df = False, orient = "split", **kwargs):
+        """向前联表查询，用LEFT JOIN在数据库中完成连接与筛选"""
+        index = self.order.index(table_name)
+        # 字段到表别名的映射，id属于被查询的表
+        owner = {field: table_name for field in table_fields[table_name]}
+        columns = [f'{table_name}."{field}"' for field in table_fields[table_name]]
+        joins = []
+        for i in range(index - 1, -1, -1):
+            parent = self.order[i]
+            joins.append(f'LEFT JOIN {parent} ON {self.order[i + 1]}."{self.name_list[i]}ID" = {parent}.id')
+            for field in table_fields[parent]:
+                if field != "id":
+                    owner[field] = parent
+                    columns.append(f'{parent}."{field}"')
+        for key in kwargs:
+            if key not in owner:
+                raise self.FieldNotExistError(self.eng2chs[table_name], key)
+        where, params = self.build_where(kwargs, owner)
+        sql = f"SELECT {', '.join(columns)} FROM {table_name} {' '.join(joins)}{where} ORDER BY {table_name}.id"
+        df = pd.read_sql_query(sql, self.conn, params=params)
+        return df if return_df else df.to_dict(orient=orient)
+
+    def get_fields(self, table_name : str):
+        """获取表字段"""
+        return list(table_fields[table_name])
+
+    def filter_field(self, df, fields : list, return_df = False, orient = "split"):
+        """筛选字段"""
+        return Model.filter_field(self, df, fields, return_df, orient)
@@ -0,0 +1,138 @@
+"""
+数据模型的回归测试，每个测试在临时目录中新建数据
+运行：python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import Model, CsvStorage, PartitionedStorage
+
+def station(name : str) -> dict:
+    return dict(测量站名称=name, 代表地区="南京", 测量站状态="上线")
+
+@pytest.mark.parametrize("wal", [False, True])
+def test_insert_unknown_field_keeps_table_file(tmp_path, wal):
+    """插入表中没有的字段被拒绝，之后的插入在重新读取后都还在"""
+    model = Model(storage=CsvStorage(str(tmp_path)), wal=wal)
+    model.insert("station", **station("A"))
+    with pytest.raises(Model.FieldNotExistError):
+        model.insert("station", **station("B"), 备注="hi")
+    with pytest.raises(Model.FieldNotExistError):
+        model.update("station", 0, 备注="hi")
+    model.insert("station", **station("C"))
+    model.close()
+    model = Model(storage=CsvStorage(str(tmp_path)), wal=wal)
+    assert model.get_df("station")["测量站名称"].tolist() == ["A", "C"]
+    assert model.get_fields("station") == ["id", "测量站名称", "代表地区", "测量站状态"]
+    assert not os.path.exists(os.path.join(str(tmp_path), "测量站表.csv.corrupt"))
+    model.close()
+
+def seed(model : Model):
+    """两个测量站，每个测量站两个地点，每个地点一个传感器，每个传感器三条测量记录"""
+    model.insert_many("station", [station("A"), station("B")])
+    model.insert_many("place", [dict(地点编号=f"P{i}", 经度=118.0, 纬度=32.0, 海拔=10.0 * i, 地点状态="上线", 测量站ID=i // 2) for i in range(4)])
+    model.insert_many("sensor", [dict(传感器类型="温度传感器", 测量值单位="℃", 传感器编号=f"S{i}", 上线时间="2023-01-01", 下线时间="2027-01-01", 传感器状态="上线", 地点ID=i) for i in range(4)])
+    model.insert_many("record", [dict(时间=f"2023-06-05 1{i % 3}:00:00", 测量值=float(i), 传感器ID=i // 3) for i in range(12)])
+
+def test_union_query_same_with_cached_view(tmp_path):
+    """建立联表视图前后，带上层表条件的联表查询结果相同"""
+    model = Model(storage=CsvStorage(str(tmp_path)))
+    seed(model)
+    conditions = [{"测量站名称": "B"}, {"地点编号": ["P0", "P3"], "测量值": (2.0, 10.0)}, {"测量站名称": "C"}, {"id": 4}]
+    expected = [model.union_query("record", return_df=True, **kwargs).reset_index(drop=True) for kwargs in conditions]
+    assert expected[0]["id"].tolist() == [6, 7, 8, 9, 10, 11]
+    model.union_query("record", return_df=True)
+    for kwargs, rows in zip(conditions, expected):
+        result = model.union_query("record", return_df=True, **kwargs).reset_index(drop=True)
+        assert result["id"].tolist() == rows["id"].tolist()
+        assert result.astype(object).equals(rows.astype(object))
+    model.close()
+
+def test_partitioned_save_crash_keeps_each_record_once(tmp_path, monkeypatch):
+    """记录改到另一个分区后，检查点写完第一个分区就崩溃，重新打开时每条记录只出现一次"""
+    import model as model_module
+    model = Model(storage=PartitionedStorage(str(tmp_path)))
+    seed(model)
+    model.checkpoint()
+    model.update("record", 0, 时间="2023-05-01 00:00:00")
+    atomic_write = model_module.atomic_write
+    written = []
+    def crash_after_first(path, write):
+        if written:
+            raise OSError("断电")
+        written.append(path)
+        atomic_write(path, write)
+    monkeypatch.setattr(model_module, "atomic_write", crash_after_first)
+    with pytest.raises(OSError):
+        model.checkpoint()
+    monkeypatch.setattr(model_module, "atomic_write", atomic_write)
+    # 模拟进程退出，释放数据目录锁
+    model.lock.release()
+    model = Model(storage=PartitionedStorage(str(tmp_path)))
+    records = model.get_df("record")
+    assert sorted(records["id"].tolist()) == list(range(12))
+    assert str(records.loc[records["id"] == 0, "时间"].iloc[0]) == "2023-05-01 00:00:00"
+    model.close()
+    model = Model(storage=PartitionedStorage(str(tmp_path)))
+    assert sorted(model.get_df("record")["id"].tolist()) == list(range(12))
+    assert model.storage.partitions() == ["2023-05", "2023-06"]
+    model.close()
+
+def test_time_index_follows_updates_and_deletes(tmp_path):
+    """删除记录、修改时间和传感器后时间排序索引不重建，按时间范围查询的结果与直接筛选相同"""
+    model = Model(storage=CsvStorage(str(tmp_path)))
+    seed(model)
+    model.query("record", 时间=("2023-06-05 10:00:00", ""), 传感器ID=0)
+    index = model.record_index
+    model.delete("record", [1, 4])
+    model.update("record", [0, 5], 时间="2023-06-05 11:30:00", 传感器ID=2)
+    model.update("record", {"传感器ID": 3}, 时间="2023-06-04 00:00:00")
+    model.insert("record", 时间="2023-06-05 11:00:00", 测量值=1.0, 传感器ID=2)
+    assert model.record_index is index
+    records = model.get_df("record")
+    for sensor_id in range(4):
+        for start, end in [("2023-06-05 10:00:00", "2023-06-05 11:30:00"), ("", "2023-06-05"), ("2023-06-04", "")]:
+            result = model.query("record", return_df=True, 时间=(start, end), 传感器ID=sensor_id)
+            mask = records["传感器ID"] == sensor_id
+            if start:
+                mask &= records["时间"] >= start
+            if end:
+                mask &= records["时间"] <= end
+            assert result["id"].tolist() == records.loc[mask, "id"].tolist()
+            assert model.record_index.lookup([sensor_id], start, end).tolist() == mask[mask].index.tolist()
+    model.close()
+
+@pytest.mark.parametrize("partitioned", [False, True])
+def test_read_only_model_sees_writer_changes(tmp_path, partitioned):
+    """写入方占用数据目录时可以只读打开，reload后看到写入方日志和检查点中的改动，只读方不能增删改"""
+    storage = PartitionedStorage if partitioned else CsvStorage
+    writer = Model(storage=storage(str(tmp_path)))
+    seed(writer)
+    with pytest.raises(Model.DataDirLockedError):
+        Model(storage=storage(str(tmp_path)))
+    reader = Model(storage=storage(str(tmp_path)), read_only=True)
+    assert len(reader.get_df("record")) == 12
+    writer.insert("record", 时间="2023-07-01 00:00:00", 测量值=99.0, 传感器ID=3)
+    writer.delete("record", [0])
+    reader.reload()
+    assert reader.query("record", return_df=True, 时间=("2023-07-01", "2023-07-02"))["测量值"].tolist() == [99.0]
+    assert 0 not in reader.get_df("record")["id"].tolist()
+    writer.update("record", 1, 测量值=-1.0)
+    writer.checkpoint()
+    reader.reload()
+    assert reader.query("record", return_df=True, id=1)["测量值"].tolist() == [-1.0]
+    with pytest.raises(Model.ReadOnlyError):
+        reader.insert("station", **station("C"))
+    with pytest.raises(Model.ReadOnlyError):
+        reader.delete("record", [1])
+    # 只读方关闭时不做检查点，写入方之后的改动仍然保留
+    writer.insert("station", **station("C"))
+    reader.close()
+    writer.close()
+    model = Model(storage=storage(str(tmp_path)))
+    assert model.get_df("station")["测量站名称"].tolist() == ["A", "B", "C"]
+    model.close()